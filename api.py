@@ -1,39 +1,76 @@
-from flask import Flask
-from flask_restx import Resource, Api, fields, reqparse, abort, marshal, marshal_with
+from flask import Flask, Response, current_app, g, request
+from flask_restx import Resource, Api, fields, reqparse, abort
 import logging
 import subprocess
 from configparser import ConfigParser
 import psycopg2 as pg
-from psycopg2 import extensions
-from healthcheck import HealthCheck, EnvironmentDump
+from psycopg2.extras import execute_values
+from healthcheck import EnvironmentDump
 from prometheus_flask_exporter import PrometheusMetrics
 from fluent import handler
 import os
 import json
+from decimal import Decimal, InvalidOperation
 import grpc
-import unary_pb2_grpc as pb2_grpc
-import unary_pb2 as pb2
 import socket
+import threading
+import time
 import requests
+from grpc_client import (
+    ConversionBatcher,
+    ConversionFailed,
+    ConverterClient,
+    RateCache,
+)
+from resilience import CircuitBreaker, CircuitOpen
+from http_client import ServiceClient
+from logging_pipeline import BatchingFluentHandler
+from cache import LRUCache
+from probes import HealthProber
+from serialization import encode_placila, encode_placilo
+from instrumentation import (
+    RequestProfiler,
+    STARTUP_PHASE,
+    StageLoggerAdapter,
+    startup_phase,
+    marshal,
+    marshal_with,
+    stage,
+)
+from outbox import OutboxDispatcher, enqueue
+from idempotency import IdempotencyConflict, IdempotencyStore, fingerprint
+from changefeed import ChangeFeed, TooManySubscribers
+from replicas import ReplicaRouter, parse_replicas
+from database import (
+    STATUSES,
+    ConnectionPool,
+    PoolExhausted,
+    PreparedConnection,
+    ensure_schema,
+)
+from queries import (
+    UPDATABLE,
+    NotUpdatable,
+    delete_placilo,
+    get_placilo,
+    get_placilo_version,
+    insert_placilo,
+    patch_placilo,
+    update_placilo,
+)
 
-app = Flask(__name__)
 
 # Load configurations from the config file
-def load_configurations():
-    app.config.from_file("config.json", load=json.load)
-
-    with open("config.json") as json_file:
+def load_configurations(app):
+    with open(os.path.join(app.root_path, "config.json")) as json_file:
         data = json.load(json_file)
-        # Override variables defined in the environment over the ones from the config file
-        for item in data:
-            if os.environ.get(item):
-                app.config[item] = os.environ.get(item)
-
-
-load_configurations()
+    app.config.update(data)
+    # Override variables defined in the environment over the ones from the config file
+    for item in data:
+        if os.environ.get(item):
+            app.config[item] = os.environ.get(item)
 
 
-@app.route("/")
 def welcome():
     return "Welcome!"
 
@@ -47,27 +84,13 @@ custom_format = {
     "code": "%(http_code)s",
 }
 logging.basicConfig(level=logging.INFO)
-l = logging.getLogger("Placila")
-h = handler.FluentHandler(
-    "Placila", host=app.config["FLUENT_IP"], port=int(app.config["FLUENT_PORT"])
-)
+l = StageLoggerAdapter(logging.getLogger("Placila"))
+# Resolved once per process by init_services; looking it up for every
+# record costs a DNS query
+ip_node = None
 formatter = handler.FluentRecordFormatter(custom_format)
-h.setFormatter(formatter)
-l.addHandler(h)
-l.info(
-    "Pripravljanje Placila Mikrostoritve",
-    extra={
-        "name_of_service": "Placila",
-        "crud_method": None,
-        "directions": None,
-        "ip_node": None,
-        "status": None,
-        "http_code": None,
-    },
-)
 
 api = Api(
-    app,
     version="1.0",
     doc="/placila/openapi",
     title="Placila API",
@@ -91,51 +114,416 @@ placiloApiModel = api.model(
         "status": fields.String(readonly=True, description="Status placila"),
     },
 )
+popraviModel = api.model(
+    "PopraviPlacilo",
+    {
+        "id_placnika": fields.Integer(description="ID placnika placila"),
+        "id_prejemnika": fields.Integer(description="ID prejemnika placila"),
+        "znesek_eur": fields.String(description="Znesek placila v EUR"),
+        "znesek_coin": fields.String(description="Znesek placila v bitcoin"),
+        "status": fields.String(description="Status placila"),
+    },
+)
 placilaApiModel = api.model(
-    "ModelPlacil", {"placila": fields.List(fields.Nested(placiloApiModel))}
+    "ModelPlacil",
+    {
+        "placila": fields.List(fields.Nested(placiloApiModel)),
+        "naslednji": fields.Integer(
+            description="Vrednost parametra after za naslednjo stran placil"
+        ),
+    },
 )
 ns = api.namespace("Placila CRUD", description="Placila koncne tocke in operacije")
 posodobiModel = api.model(
     "PosodobiPlacilo", {"atribut": fields.String, "vrednost": fields.String}
 )
-metrics = PrometheusMetrics(app)
 
-grpc_channel = grpc.insecure_channel(
-    "{}:{}".format(app.config["GRPC_SERVER_IP"], app.config["GRPC_SERVER_PORT"])
+
+def amount(value):
+    try:
+        value = Decimal(value)
+    except InvalidOperation:
+        raise ValueError("Znesek %s ni veljavno stevilo" % value)
+    if not value.is_finite():
+        raise ValueError("Znesek %s ni koncno stevilo" % value)
+    return value
+
+
+def payment_amount(value):
+    """
+    EUR amount of a payment, which must be a finite positive number
+    """
+    value = amount(value)
+    if value <= 0:
+        raise ValueError("Znesek %s ni pozitiven" % value)
+    return value
+
+
+def check_amounts(values):
+    """
+    Abort with 400 unless every amount among the column `values` is valid
+    """
+    for column in ("znesek_eur", "znesek_coin"):
+        if column in values:
+            try:
+                payment_amount(str(values[column]))
+            except ValueError as e:
+                abort(400, str(e))
+
+
+listParser = reqparse.RequestParser()
+listParser.add_argument(
+    "limit", type=int, location="args", help="Najvecje stevilo vrnjenih placil"
+)
+listParser.add_argument(
+    "after", type=int, location="args", help="Vrni placila z ID vecjim od after"
+)
+listParser.add_argument("id_placnika", type=int, location="args")
+listParser.add_argument("id_prejemnika", type=int, location="args")
+listParser.add_argument("status", type=str, location="args")
+listParser.add_argument(
+    "znesek_od", type=amount, location="args", help="Najmanjsi znesek v EUR"
+)
+listParser.add_argument(
+    "znesek_do", type=amount, location="args", help="Najvecji znesek v EUR"
+)
+listParser.add_argument(
+    "stream",
+    type=str,
+    location="args",
+    choices=("ndjson", "json"),
+    help="Pretakaj placila kot NDJSON ali JSON tabelo",
 )
-stub = pb2_grpc.convertToCryptoStub(grpc_channel)
+
+izbrisiModel = api.model(
+    "IzbrisiPlacila",
+    {
+        "ids": fields.List(fields.Integer, description="ID-ji placil za izbris"),
+        "id_placnika": fields.Integer(description="Izbrisi placila placnika"),
+        "id_prejemnika": fields.Integer(description="Izbrisi placila prejemnika"),
+        "status": fields.String(description="Izbrisi placila s statusom"),
+    },
+)
+izbrisanaApiModel = api.model(
+    "IzbrisanaPlacila", {"izbrisani": fields.List(fields.Integer)}
+)
+rezultatModel = api.model(
+    "RezultatPaketnegaPlacila",
+    {
+        "indeks": fields.Integer(description="Zaporedna stevilka placila v paketu"),
+        "id": fields.Integer(description="ID placila"),
+        "koda": fields.Integer(description="HTTP koda rezultata za to placilo"),
+        "sporocilo": fields.String(description="Opis napake"),
+        "placilo": fields.Nested(placiloApiModel, allow_null=True),
+    },
+)
+paketApiModel = api.model(
+    "PaketPlacil", {"rezultati": fields.List(fields.Nested(rezultatModel))}
+)
+deleteParser = reqparse.RequestParser()
+deleteParser.add_argument("id_placnika", type=int, location="json")
+deleteParser.add_argument("id_prejemnika", type=int, location="json")
+deleteParser.add_argument("status", type=str, location="json")
+
+povzetekModel = api.model(
+    "PovzetekSkupine",
+    {
+        "skupina": fields.String(
+            description="Vrednost stolpca, po katerem so zdruzena"
+        ),
+        "stevilo": fields.Integer(description="Stevilo placil v skupini"),
+        "znesek_eur": fields.String(description="Vsota zneskov v EUR"),
+        "znesek_coin": fields.String(description="Vsota zneskov v bitcoin"),
+    },
+)
+povzetekApiModel = api.model(
+    "PovzetekPlacil", {"povzetek": fields.List(fields.Nested(povzetekModel))}
+)
+summaryParser = reqparse.RequestParser()
+summaryParser.add_argument(
+    "group_by",
+    type=str,
+    location="args",
+    required=True,
+    choices=("id_placnika", "id_prejemnika", "status"),
+    help="Zdruzi po id_placnika, id_prejemnika ali status",
+)
+summaryParser.add_argument("id_placnika", type=int, location="args")
+summaryParser.add_argument("id_prejemnika", type=int, location="args")
+summaryParser.add_argument("status", type=str, location="args")
+summaryParser.add_argument(
+    "znesek_od", type=amount, location="args", help="Najmanjsi znesek v EUR"
+)
+summaryParser.add_argument(
+    "znesek_do", type=amount, location="args", help="Najvecji znesek v EUR"
+)
+dogodkiParser = reqparse.RequestParser()
+dogodkiParser.add_argument("id", type=int, location="args")
+dogodkiParser.add_argument("id_placnika", type=int, location="args")
+dogodkiParser.add_argument("id_prejemnika", type=int, location="args")
+dogodkiParser.add_argument("status", type=str, location="args")
+
+metrics = PrometheusMetrics.for_app_factory()
+
+
+# Clients and pools are created per process by init_services, after the
+# WSGI server has forked its workers.
+h = None
+db_pool = None
+converter = None
+prevozi = None
+dispatcher = None
+prober = None
+batcher = None
+rate_cache = None
+placilo_cache = None
+idempotency = None
+changefeed = None
+router = None
+profiler = RequestProfiler("profiles")
 
 
 def get_bitcoins(eur):
     """
-    Client function to call the rpc for GetServerResponse
+    Convert to BTC from the cached exchange rate, falling back to the rpc
     """
-    message = pb2.Message(message=eur)
-    print(f"Sent request to convert {message} to bitcoins")
-    return stub.convertToBitcoin(message)
+    try:
+        payment_amount(eur)
+    except ValueError as e:
+        abort(400, str(e))
+    with stage("grpc"):
+        response = rate_cache.convert(eur)
+    if not response.received:
+        abort(400, "Znesek %s ni veljaven" % eur)
+    try:
+        return parse_bitcoins(response)
+    except InvalidOperation:
+        abort(502, "Pretvornik je vrnil neveljaven znesek %s" % response.message)
 
 
-def connect_to_database():
-    return pg.connect(
-        database=app.config["PGDATABASE"],
-        user=app.config["PGUSER"],
-        password=app.config["PGPASSWORD"],
-        port=app.config["DATABASE_PORT"],
-        host=app.config["DATABASE_IP"],
+def parse_bitcoins(response):
+    """
+    BTC amount of a conversion response, with the precision it was sent with
+    """
+    return Decimal(response.message.strip())
+
+
+def convert_amounts(amounts):
+    """
+    Convert every distinct EUR amount to bitcoins once
+
+    Returns a dict of amount -> bitcoins and a dict of amount -> error for
+    the amounts the converter could not handle.
+    """
+    amounts = list(set(amounts))
+    bitcoins = {}
+    errors = {}
+    try:
+        with stage("grpc"):
+            responses = rate_cache.convert_many(amounts)
+    except grpc.RpcError as e:
+        return bitcoins, dict.fromkeys(amounts, e.details())
+    except (CircuitOpen, ConversionFailed) as e:
+        return bitcoins, dict.fromkeys(amounts, str(e))
+    for eur, response in zip(amounts, responses):
+        if not response.received:
+            errors[eur] = "Zneska %s ni bilo mogoce pretvoriti" % eur
+            continue
+        try:
+            bitcoins[eur] = parse_bitcoins(response)
+        except InvalidOperation:
+            errors[eur] = "Pretvornik je vrnil neveljaven znesek %s" % response.message
+    return bitcoins, errors
+
+
+def get_db():
+    """
+    Borrow a pooled connection for the duration of the current request
+    """
+    if "db" not in g:
+        ensure_schema(db_pool)
+        g.db = db_pool.getconn()
+    return g.db
+
+
+# Set on responses to writes so the client's next reads see its own changes
+PRIMARY_COOKIE = "placila_primary"
+
+
+def read_pool():
+    """
+    Pool for a read: the primary for clients that just wrote or ask for it
+    with X-Read-Primary, otherwise a replica that is caught up
+    """
+    pinned = PRIMARY_COOKIE in request.cookies or bool(
+        request.headers.get("X-Read-Primary")
     )
+    return router.pool_for_read(pinned)
 
 
-def check_database_connection():
-    conn = connect_to_database()
-    if conn.poll() == extensions.POLL_OK:
-        print("POLL: POLL_OK")
-    elif conn.poll() == extensions.POLL_READ:
-        print("POLL: POLL_READ")
-    elif conn.poll() == extensions.POLL_WRITE:
-        print("POLL: POLL_WRITE")
-    else:
-        return 409
-    return 200
+def get_read_db():
+    """
+    Borrow a connection for reads, from the pool chosen by read_pool
+
+    Reads after a write in the same request use the write connection.
+    """
+    if "db" in g:
+        return g.db
+    if "read_db" not in g:
+        ensure_schema(db_pool)
+        g.read_pool = read_pool()
+        g.read_db = g.read_pool.getconn()
+    return g.read_db
+
+
+def read_from_replica():
+    return g.get("read_pool", db_pool) is not db_pool
+
+
+def return_db(exception):
+    conn = g.pop("db", None)
+    if conn is not None:
+        db_pool.putconn(conn)
+    conn = g.pop("read_db", None)
+    if conn is not None:
+        g.pop("read_pool").putconn(conn)
+
+
+def pin_to_primary(response):
+    if (
+        router is not None
+        and router.replicas
+        and request.method in ("POST", "PUT", "PATCH", "DELETE")
+        and response.status_code < 400
+    ):
+        response.set_cookie(
+            PRIMARY_COOKIE,
+            "1",
+            max_age=int(router.max_lag + router.interval) + 1,
+            httponly=True,
+        )
+    return response
+
+
+@api.errorhandler(PoolExhausted)
+def handle_pool_exhausted(error):
+    return {"message": "Baza je preobremenjena, poskusite ponovno"}, 503
+
+
+UNAVAILABLE_MESSAGES = {
+    "convertToCrypto": "Pretvornik v bitcoine trenutno ni dosegljiv",
+    "aktivni_prevozi": "Storitev aktivni prevozi trenutno ni dosegljiva",
+}
+
+
+@api.errorhandler(ConversionFailed)
+def handle_conversion_failed(error):
+    return {"message": "Pretvorba v bitcoine ni uspela: %s" % error}, 502
+
+
+@api.errorhandler(CircuitOpen)
+def handle_circuit_open(error):
+    return {"message": UNAVAILABLE_MESSAGES.get(error.name, str(error))}, 503
+
+
+@api.errorhandler(IdempotencyConflict)
+def handle_idempotency_conflict(error):
+    return {
+        "message": "Idempotency-Key %s je bil ze uporabljen za drugacen zahtevek"
+        % error.key
+    }, 422
+
+
+@api.errorhandler(TooManySubscribers)
+def handle_too_many_subscribers(error):
+    return {"message": "Prevec narocnikov na spremembe placil"}, 503
+
+
+@api.errorhandler(NotUpdatable)
+def handle_not_updatable(error):
+    return {"message": "Atributa %s ni mogoce posodobiti" % error.column}, 400
+
+
+@api.errorhandler(pg.DataError)
+def handle_data_error(error):
+    return {"message": "Neveljavna vrednost: %s" % error.diag.message_primary}, 400
+
+
+@api.errorhandler(grpc.RpcError)
+def handle_rpc_error(error):
+    return {"message": "Pretvorba v bitcoine ni uspela: %s" % error.details()}, 502
+
+
+@api.errorhandler(requests.RequestException)
+def handle_http_error(error):
+    return {"message": "Storitev aktivni prevozi ni odgovorila: %s" % error}, 502
+
+
+def izbrisi_prevoz(payload):
+    """
+    Outbox handler that deletes the prevoz of a paid placilo
+    """
+    resp = prevozi.delete("aktivni_prevozi/" + str(payload["id"]))
+    # 404 means an earlier delivery already deleted it
+    if resp.status_code >= 400 and resp.status_code != 404:
+        raise RuntimeError(
+            "aktivni_prevozi answered %s for prevoz %s"
+            % (resp.status_code, payload["id"])
+        )
+    l.info(
+        "Prevoz z ID %s izbrisan" % str(payload["id"]),
+        extra={
+            "name_of_service": "Placila",
+            "crud_method": "put",
+            "directions": "out",
+            "ip_node": ip_node,
+            "status": "success",
+            "http_code": resp.status_code,
+        },
+    )
+
+
+def check_database_connection(timeout):
+    try:
+        with db_pool.connection(timeout=timeout) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+    except (pg.Error, PoolExhausted) as e:
+        return False, str(e)
+    return True, "SELECT 1 OK"
+
+
+def check_converter(timeout):
+    try:
+        grpc.channel_ready_future(converter.channel).result(timeout=timeout)
+    except grpc.FutureTimeoutError:
+        return False, "Kanal do pretvornika ni pripravljen: %s" % converter.state.name
+    if converter.breaker.state == CircuitBreaker.OPEN:
+        return False, "Varovalka pretvornika je odprta"
+    return True, "Kanal pripravljen"
+
+
+def check_aktivni_prevozi(timeout):
+    try:
+        if not prevozi.ping(timeout=timeout):
+            return False, "Storitev aktivni prevozi vraca napake"
+    except requests.RequestException as e:
+        return False, str(e)
+    if prevozi.breaker.state == CircuitBreaker.OPEN:
+        return False, "Varovalka storitve aktivni prevozi je odprta"
+    return True, "Storitev odgovarja"
+
+
+def check_replicas():
+    lag = dict(router.lag)
+    if not lag:
+        return False, "Se ni preverjeno"
+    output = ", ".join(
+        "%s: %s" % (name, "nedosegljiva" if s is None else "zaostaja %.1fs" % s)
+        for name, s in sorted(lag.items())
+    )
+    return all(s is not None and s <= router.max_lag for s in lag.values()), output
 
 
 def application_data():
@@ -146,6 +534,15 @@ def application_data():
 
 
 class PlaciloModel:
+    __slots__ = (
+        "id",
+        "id_placnika",
+        "id_prejemnika",
+        "znesek_eur",
+        "znesek_coin",
+        "status",
+    )
+
     def __init__(self, id, id_placnika, id_prejemnika, znesek_eur, znesek_coin, status):
         self.id = id
         self.id_placnika = id_placnika
@@ -154,40 +551,106 @@ class PlaciloModel:
         self.znesek_coin = znesek_coin
         self.status = status
 
+    @classmethod
+    def from_row(cls, row):
+        # Amounts are NUMERIC but the API returns them as strings
+        return cls(*[format(el, "f") if isinstance(el, Decimal) else el for el in row])
 
-placilaPolja = {
-    "id": fields.Integer,
-    "id_placnika": fields.Integer,
-    "id_prejemnika": fields.Integer,
-    "znesek_eur": fields.String,
-    "znesek_coin": fields.String,
-    "status": fields.String,
-}
 
+def filter_conditions(args):
+    """
+    WHERE conditions and parameters for the payer, payee, status and amount
+    filters
+    """
+    conditions = []
+    params = []
+    for column in ("id_placnika", "id_prejemnika", "status"):
+        if args.get(column) is not None:
+            conditions.append("{} = %s".format(column))
+            params.append(args[column])
+    if args.get("znesek_od") is not None:
+        conditions.append("znesek_eur >= %s")
+        params.append(args["znesek_od"])
+    if args.get("znesek_do") is not None:
+        conditions.append("znesek_eur <= %s")
+        params.append(args["znesek_do"])
+    return conditions, params
+
+
+def where_clause(conditions):
+    if not conditions:
+        return ""
+    return " WHERE " + " AND ".join(conditions)
+
+
+def stream_placila(conditions, params, fmt):
+    """
+    Stream placila through a server-side cursor, one batch of rows at a time
+    """
+    ensure_schema(db_pool)
+    query = "SELECT * FROM placila" + where_clause(conditions) + " ORDER BY id"
+    itersize = int(current_app.config["STREAM_BATCH_SIZE"])
+    pool = read_pool()
+
+    # The query runs before the response starts, so an invalid filter still
+    # reaches the error handlers instead of breaking off a 200 mid-stream
+    conn = pool.getconn()
+    try:
+        cur = conn.cursor(name="placila_stream")
+        cur.itersize = itersize
+        cur.execute(query, params)
+    except Exception:
+        pool.putconn(conn)
+        raise
+
+    def generate():
+        if fmt == "json":
+            yield '{"placila": ['
+        separator = ""
+        for row in cur:
+            line = encode_placilo(row)
+            if fmt == "json":
+                yield separator + line
+                separator = ","
+            else:
+                yield line + "\n"
+        if fmt == "json":
+            yield '], "naslednji": null}'
+
+    mimetype = "application/x-ndjson" if fmt == "ndjson" else "application/json"
+    response = Response(generate(), mimetype=mimetype)
+    response.call_on_close(lambda: pool.putconn(conn))
+    return response
 
-class Placilo(Resource):
+
+class PlacilaResource(Resource):
+    """
+    Resource that borrows a pooled connection only once it touches the database
+    """
+
+    @property
+    def conn(self):
+        return get_db()
+
+    @property
+    def cur(self):
+        if getattr(self, "_cur", None) is None:
+            self._cur = self.conn.cursor()
+        return self._cur
+
+    @property
+    def read_cur(self):
+        """
+        Cursor for requests that only read, possibly on a replica
+        """
+        if getattr(self, "_read_cur", None) is None:
+            self._read_cur = get_read_db().cursor()
+        return self._read_cur
+
+
+class Placilo(PlacilaResource):
     def __init__(self, *args, **kwargs):
         self.table_name = "placila"
-        self.conn = connect_to_database()
-        self.cur = self.conn.cursor()
-        self.cur.execute(
-            "select exists(select * from information_schema.tables where table_name=%s)",
-            (self.table_name,),
-        )
-        if self.cur.fetchone()[0]:
-            print("Table {0} already exists".format(self.table_name))
-        else:
-            self.cur.execute(
-                """CREATE TABLE placila (
-                           id INT NOT NULL,
-                           id_placnika INT NOT NULL,
-                           id_prejemnika INT NOT NULL,
-                           znesek_eur CHAR(20),
-                           znesek_coin CHAR(20),
-                           status CHAR(20)
-                        )"""
-            )
-        self.aktivni_prevozi = app.config["AKTIVNI_IP"]
 
         self.parser = reqparse.RequestParser()
         self.parser.add_argument("id", type=int)
@@ -201,7 +664,8 @@ class Placilo(Resource):
 
         super(Placilo, self).__init__(*args, **kwargs)
 
-    @marshal_with(placiloApiModel)
+    @ns.response(200, "Placilo", placiloApiModel)
+    @ns.response(304, "Placilo se ni spremenilo")
     @ns.response(404, "Placilo ni najden")
     @ns.doc("Vrni placilo")
     def get(self, id):
@@ -214,22 +678,56 @@ class Placilo(Resource):
                 "name_of_service": "Placila",
                 "crud_method": "get",
                 "directions": "in",
-                "ip_node": socket.gethostbyname(socket.gethostname()),
+                "ip_node": ip_node,
                 "status": None,
                 "http_code": None,
             },
         )
-        self.cur.execute("SELECT * FROM placila WHERE id = %s" % str(id))
-        row = self.cur.fetchall()
+        cached = placilo_cache.get(id)
+        if cached is None:
+            # A write that commits while the row loads invalidates the key;
+            # the generation keeps the row read before it out of the cache
+            generation = placilo_cache.generation(id)
+            cached = self.load(id)
+            # A replica may not have replayed a recent change yet
+            if not (read_from_replica() and router.changed_recently(id)):
+                placilo_cache.set(id, cached, generation)
+        body, etag = cached
+
+        if etag in request.if_none_match:
+            return Response(status=304, headers={"ETag": '"%s"' % etag})
+
+        l.info(
+            "Vrni placilo z ID %s" % str(id),
+            extra={
+                "name_of_service": "Placila",
+                "crud_method": "get",
+                "directions": "out",
+                "ip_node": ip_node,
+                "status": None,
+                "http_code": 200,
+            },
+        )
+        return Response(
+            body, mimetype="application/json", headers={"ETag": '"%s"' % etag}
+        )
+
+    def load(self, id):
+        """
+        Read a payment and serialize it, returning the JSON body and its ETag
+
+        The ETag is the row version, which PATCH accepts in If-Match.
+        """
+        placilo = get_placilo_version(self.read_cur, id)
 
-        if len(row) == 0:
+        if placilo is None:
             l.warning(
                 "Placilo z ID %s ni bil najden" % str(id),
                 extra={
                     "name_of_service": "Placila",
                     "crud_method": "get",
                     "directions": "out",
-                    "ip_node": socket.gethostbyname(socket.gethostname()),
+                    "ip_node": ip_node,
                     "status": "fail",
                     "http_code": 404,
                 },
@@ -237,31 +735,22 @@ class Placilo(Resource):
 
             abort(404)
 
-        d = {}
-        for el, k in zip(row[0], placilaPolja):
-            d[k] = el
+        row, etag = placilo
+        with stage("marshal"):
+            body = encode_placilo(row) + "\n"
+        return body, etag
 
-        placilo = PlaciloModel(
-            id=d["id"],
-            id_placnika=d["id_placnika"],
-            id_prejemnika=d["id_prejemnika"],
-            znesek_eur=d["znesek_eur"],
-            znesek_coin=d["znesek_coin"],
-            status=d["status"].strip(),
-        )
-
-        l.info(
-            "Vrni placilo z ID %s" % str(id),
-            extra={
-                "name_of_service": "Placila",
-                "crud_method": "get",
-                "directions": "out",
-                "ip_node": socket.gethostbyname(socket.gethostname()),
-                "status": None,
-                "http_code": 200,
-            },
-        )
-        return placilo, 200
+    def preveri_prevoz(self, id):
+        """
+        Prevoz mora obstajati in biti dostavljen, preden je placilo placano
+        """
+        with stage("http"):
+            resp = prevozi.get("aktivni_prevozi/" + str(id))
+        if resp.status_code != 200:
+            abort(411, f"Placilo ne more bit placano, saj prevoz {id} ne obstaja")
+        prevoz = resp.json()
+        if "Da" not in prevoz["prejeto"]:
+            abort(412, f"Prevoz {id} se ni bil dostavljen, pocakajte s placilom!")
 
     @marshal_with(placiloApiModel)
     @ns.expect(posodobiModel)
@@ -277,7 +766,7 @@ class Placilo(Resource):
                 "name_of_service": "Placila",
                 "crud_method": "put",
                 "directions": "in",
-                "ip_node": socket.gethostbyname(socket.gethostname()),
+                "ip_node": ip_node,
                 "status": None,
                 "http_code": None,
             },
@@ -285,53 +774,38 @@ class Placilo(Resource):
         args = self.parser.parse_args()
         attribute = args["atribut"]
         value = args["vrednost"]
-        self.cur.execute(
-            """UPDATE {0} SET {1} = '{2}' WHERE id = {3}""".format(
-                self.table_name, attribute, value, id
-            )
-        )
-        self.conn.commit()
+        placano = attribute == "status" and value == "placano"
+
+        check_amounts({attribute: value})
+        if placano:
+            self.preveri_prevoz(id)
 
-        self.cur.execute("SELECT * FROM placila WHERE id = %s" % str(id))
-        row = self.cur.fetchall()
+        row = update_placilo(self.cur, id, attribute, value)
 
-        if len(row) == 0:
+        if row is None:
+            self.conn.rollback()
             l.warning(
                 "Placilo z ID %s ni bil najden" % str(id),
                 extra={
                     "name_of_service": "Placila",
                     "crud_method": "put",
                     "directions": "out",
-                    "ip_node": socket.gethostbyname(socket.gethostname()),
+                    "ip_node": ip_node,
                     "status": "fail",
                     "http_code": 404,
                 },
             )
             abort(410, f"Placilo z {id} ni najdeno!")
 
-        d = {}
-        for el, k in zip(row[0], placilaPolja):
-            d[k] = el
-
-        if attribute == "status" and value == "placano":
-            # Zbrisi prevoz
-            resp = requests.get(self.aktivni_prevozi + "aktivni_prevozi/" + str(id))
-            if resp.status_code != 200:
-                abort(411, f"Placilo ne more bit placano, saj prevoz {id} ne obstaja")
-            prevoz = resp.json()
-            if "Da" not in prevoz["prejeto"]:
-                abort(412, f"Prevoz {id} se ni bil dostavljen, pocakajte s placilom!")
-            
-            requests.delete(self.aktivni_prevozi + "aktivni_prevozi/" + str(id))
+        if placano:
+            # Prevoz se zbrise asinhrono, ko je sprememba statusa shranjena
+            enqueue(self.cur, "izbrisi_prevoz", id, {"id": id})
+        self.conn.commit()
+        placilo_cache.invalidate(id)
+        if placano:
+            dispatcher.wake()
 
-        placilo = PlaciloModel(
-            id=d["id"],
-            id_placnika=d["id_placnika"],
-            id_prejemnika=d["id_prejemnika"],
-            znesek_eur=d["znesek_eur"],
-            znesek_coin=d["znesek_coin"],
-            status=d["status"].strip(),
-        )
+        placilo = PlaciloModel.from_row(row)
 
         l.info(
             "Placilo z ID %s posodobljeno" % str(id),
@@ -339,7 +813,7 @@ class Placilo(Resource):
                 "name_of_service": "Placila",
                 "crud_method": "put",
                 "directions": "out",
-                "ip_node": socket.gethostbyname(socket.gethostname()),
+                "ip_node": ip_node,
                 "status": "success",
                 "http_code": 200,
             },
@@ -347,6 +821,98 @@ class Placilo(Resource):
 
         return placilo, 200
 
+    @ns.expect(popraviModel)
+    @ns.param(
+        "If-Match",
+        "ETag placila; posodobi ga samo, ce se medtem ni spremenilo",
+        _in="header",
+    )
+    @ns.response(200, "Placilo", placiloApiModel)
+    @ns.response(404, "Placilo ni najden")
+    @ns.response(412, "Placilo se je medtem spremenilo")
+    @ns.doc("Popravi placilo")
+    def patch(self, id):
+        """
+        Posodobi vec podatkov placila naenkrat
+        """
+        l.info(
+            "Popravi placilo z ID %s" % str(id),
+            extra={
+                "name_of_service": "Placila",
+                "crud_method": "patch",
+                "directions": "in",
+                "ip_node": ip_node,
+                "status": None,
+                "http_code": None,
+            },
+        )
+        values = request.get_json(force=True, silent=True)
+        if not isinstance(values, dict) or not values:
+            abort(400, "Podajte JSON objekt z vsaj enim podatkom placila")
+        for column, value in values.items():
+            if column not in UPDATABLE:
+                raise NotUpdatable(column)
+            if value is None or isinstance(value, (bool, dict, list)):
+                abort(400, "Neveljavna vrednost za %s" % column)
+        check_amounts(values)
+
+        version = None
+        if request.if_match and not request.if_match.star_tag:
+            tags = request.if_match.as_set()
+            if len(tags) != 1 or not next(iter(tags)).isdigit():
+                abort(412, f"Placilo z ID {id} se je medtem spremenilo")
+            version = tags.pop()
+
+        placano = values.get("status") == "placano"
+        if placano:
+            self.preveri_prevoz(id)
+
+        placilo = patch_placilo(self.cur, id, values, version)
+
+        if placilo is None:
+            obstaja = version is not None and get_placilo(self.cur, id) is not None
+            self.conn.rollback()
+            if obstaja:
+                abort(412, f"Placilo z ID {id} se je medtem spremenilo")
+            l.warning(
+                "Placilo z ID %s ni bil najden" % str(id),
+                extra={
+                    "name_of_service": "Placila",
+                    "crud_method": "patch",
+                    "directions": "out",
+                    "ip_node": ip_node,
+                    "status": "fail",
+                    "http_code": 404,
+                },
+            )
+            abort(404)
+
+        if placano:
+            enqueue(self.cur, "izbrisi_prevoz", id, {"id": id})
+        self.conn.commit()
+        placilo_cache.invalidate(id)
+        if placano:
+            dispatcher.wake()
+
+        row, etag = placilo
+        with stage("marshal"):
+            body = encode_placilo(row) + "\n"
+
+        l.info(
+            "Placilo z ID %s popravljeno" % str(id),
+            extra={
+                "name_of_service": "Placila",
+                "crud_method": "patch",
+                "directions": "out",
+                "ip_node": ip_node,
+                "status": "success",
+                "http_code": 200,
+            },
+        )
+        return Response(
+            body, mimetype="application/json", headers={"ETag": '"%s"' % etag}
+        )
+
     @ns.doc("Izbrisi placilo")
     @ns.response(404, "Placilo ni najdeno")
     @ns.response(204, "Placilo izbrisano")
@@ -360,32 +926,28 @@ class Placilo(Resource):
                 "name_of_service": "Placila",
                 "crud_method": "delete",
                 "directions": "in",
-                "ip_node": socket.gethostbyname(socket.gethostname()),
+                "ip_node": ip_node,
                 "status": None,
                 "http_code": None,
             },
         )
-        self.cur.execute("SELECT * FROM placila")
-        rows = self.cur.fetchall()
-        ids = []
-        for row in rows:
-            ids.append(row[0])
+        izbrisan = delete_placilo(self.cur, id)
+        self.conn.commit()
+        placilo_cache.invalidate(id)
 
-        if id not in ids:
+        if izbrisan is None:
             l.warning(
                 "Placilo z ID %s ni bil najden" % str(id),
                 extra={
                     "name_of_service": "Placila",
                     "crud_method": "delete",
                     "directions": "out",
-                    "ip_node": socket.gethostbyname(socket.gethostname()),
+                    "ip_node": ip_node,
                     "status": "fail",
                     "http_code": 404,
                 },
             )
             abort(404)
-        self.cur.execute("DELETE FROM placila WHERE id = %s" % str(id))
-        self.conn.commit()
 
         l.info(
             "Placilo z ID %s izbrisano" % str(id),
@@ -393,7 +955,7 @@ class Placilo(Resource):
                 "name_of_service": "Placila",
                 "crud_method": "delete",
                 "directions": "out",
-                "ip_node": socket.gethostbyname(socket.gethostname()),
+                "ip_node": ip_node,
                 "status": "success",
                 "http_code": 204,
             },
@@ -402,28 +964,9 @@ class Placilo(Resource):
         return 204
 
 
-class ListPlacil(Resource):
+class ListPlacil(PlacilaResource):
     def __init__(self, *args, **kwargs):
         self.table_name = "placila"
-        self.conn = connect_to_database()
-        self.cur = self.conn.cursor()
-        self.cur.execute(
-            "select exists(select * from information_schema.tables where table_name=%s)",
-            (self.table_name,),
-        )
-        if self.cur.fetchone()[0]:
-            print("Table {0} already exists".format(self.table_name))
-        else:
-            self.cur.execute(
-                """CREATE TABLE placila (
-                           id INT NOT NULL,
-                           id_placnika INT NOT NULL,
-                           id_prejemnika INT NOT NULL,
-                           znesek_eur CHAR(20),
-                           znesek_coin CHAR(20),
-                           status CHAR(20)
-                        )"""
-            )
         self.parser = reqparse.RequestParser()
         self.parser.add_argument(
             "id", type=int, required=True, help="ID plačila je obvezen"
@@ -446,11 +989,12 @@ class ListPlacil(Resource):
 
         super(ListPlacil, self).__init__(*args, **kwargs)
 
-    @ns.marshal_list_with(placilaApiModel)
+    @ns.response(200, "Placila", placilaApiModel)
+    @ns.expect(listParser)
     @ns.doc("Vrni vsa placila")
     def get(self):
         """
-        Vrni vsa placila
+        Vrni vsa placila, po straneh ali pretocno
         """
         l.info(
             "Zahtevaj placila",
@@ -458,32 +1002,34 @@ class ListPlacil(Resource):
                 "name_of_service": "Placila",
                 "crud_method": "get",
                 "directions": "in",
-                "ip_node": socket.gethostbyname(socket.gethostname()),
+                "ip_node": ip_node,
                 "status": None,
                 "http_code": None,
             },
         )
-        self.cur.execute("SELECT * FROM placila")
-        rows = self.cur.fetchall()
-        ds = {}
-        i = 0
-        for row in rows:
-            ds[i] = {}
-            for el, k in zip(row, placilaPolja):
-                ds[i][k] = el
-            i += 1
-
-        placila = []
-        for d in ds:
-            placilo = PlaciloModel(
-                id=ds[d]["id"],
-                id_placnika=ds[d]["id_placnika"],
-                id_prejemnika=ds[d]["id_prejemnika"],
-                znesek_eur=ds[d]["znesek_eur"].strip(),
-                znesek_coin=ds[d]["znesek_coin"].strip(),
-                status=ds[d]["status"].strip(),
+        args = listParser.parse_args()
+        limit = args["limit"]
+        if limit is not None and not 0 < limit <= int(
+            current_app.config["PAGE_LIMIT_MAX"]
+        ):
+            abort(
+                400,
+                "Parameter limit mora biti med 1 in %s"
+                % current_app.config["PAGE_LIMIT_MAX"],
             )
-            placila.append(placilo)
+        conditions, params = filter_conditions(args)
+        if args["after"] is not None:
+            conditions.append("id > %s")
+            params.append(args["after"])
+        if args["stream"]:
+            return stream_placila(conditions, params, args["stream"])
+
+        query = "SELECT * FROM placila" + where_clause(conditions) + " ORDER BY id"
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
+        self.read_cur.execute(query, params)
+        rows = self.read_cur.fetchall()
 
         l.info(
             "Vrni placila",
@@ -491,15 +1037,80 @@ class ListPlacil(Resource):
                 "name_of_service": "Placila",
                 "crud_method": "get",
                 "directions": "out",
-                "ip_node": socket.gethostbyname(socket.gethostname()),
+                "ip_node": ip_node,
                 "status": "success",
                 "http_code": 200,
             },
         )
-        return {"placila": placila}, 200
+        naslednji = None
+        if limit is not None and len(rows) == limit:
+            naslednji = rows[-1][0]
+        with stage("marshal"):
+            body = encode_placila(rows, naslednji) + "\n"
+        return Response(body, mimetype="application/json")
+
+    @marshal_with(izbrisanaApiModel)
+    @ns.expect(izbrisiModel)
+    @ns.response(400, "Manjka seznam ID-jev ali filter")
+    @ns.doc("Izbrisi vec placil")
+    def delete(self):
+        """
+        Izbrisi placila po seznamu ID-jev ali po filtru z enim ukazom
+        """
+        l.info(
+            "Izbrisi placila",
+            extra={
+                "name_of_service": "Placila",
+                "crud_method": "delete",
+                "directions": "in",
+                "ip_node": ip_node,
+                "status": None,
+                "http_code": None,
+            },
+        )
+        args = deleteParser.parse_args()
+        conditions, params = filter_conditions(args)
+        # reqparse's type=list would split a string into its characters
+        ids = (request.get_json(silent=True) or {}).get("ids")
+        if ids is not None:
+            if not isinstance(ids, list) or not all(
+                isinstance(i, int) and not isinstance(i, bool) for i in ids
+            ):
+                abort(400, "Seznam ids mora biti JSON tabela celih stevil")
+            conditions.append("id = ANY(%s)")
+            params.append(ids)
+        if not conditions:
+            abort(400, "Podajte seznam ids ali vsaj en filter")
+
+        self.cur.execute(
+            "DELETE FROM placila" + where_clause(conditions) + " RETURNING id", params
+        )
+        izbrisani = [row[0] for row in self.cur.fetchall()]
+        self.conn.commit()
+        for i in izbrisani:
+            placilo_cache.invalidate(i)
+
+        l.info(
+            "Izbrisanih placil: %s" % len(izbrisani),
+            extra={
+                "name_of_service": "Placila",
+                "crud_method": "delete",
+                "directions": "out",
+                "ip_node": ip_node,
+                "status": "success",
+                "http_code": 200,
+            },
+        )
+        return {"izbrisani": izbrisani}, 200
 
     @marshal_with(placiloApiModel)
     @ns.expect(placiloApiModel)
+    @ns.param(
+        "Idempotency-Key",
+        "Ponovljen zahtevek z istim kljucem vrne shranjen odgovor",
+        _in="header",
+    )
+    @ns.response(422, "Kljuc je bil ze uporabljen za drugacen zahtevek")
     @ns.doc("Dodaj placilo")
     def post(self):
         """
@@ -511,49 +1122,77 @@ class ListPlacil(Resource):
                 "name_of_service": "Placila",
                 "crud_method": "post",
                 "directions": "in",
-                "ip_node": socket.gethostbyname(socket.gethostname()),
+                "ip_node": ip_node,
                 "status": None,
                 "http_code": None,
             },
         )
         args = self.parser.parse_args()
-        values = []
-        for a in args.values():
-            values.append(a)
-
+        key = request.headers.get("Idempotency-Key")
+        if key is not None:
+            if not 0 < len(key) <= 255:
+                abort(400, "Idempotency-Key mora imeti od 1 do 255 znakov")
+            digest = fingerprint(args)
+            stored = idempotency.lookup(self.cur, key, digest)
+            # Do not hold the transaction open during the conversion
+            self.conn.rollback()
+            if stored is not None:
+                return self.replay(stored)
         l.info(
             "Pretvori v bitcoin",
             extra={
                 "name_of_service": "Placila",
                 "crud_method": "post",
                 "directions": "out",
-                "ip_node": socket.gethostbyname(socket.gethostname()),
+                "ip_node": ip_node,
                 "status": None,
                 "http_code": None,
             },
         )
-        bitcoins = str(get_bitcoins(args["znesek_eur"]))
-        bitcoins = bitcoins[10:17]
+        bitcoins = format(get_bitcoins(args["znesek_eur"]), "f")
         l.info(
             "Pretvorjeno v bitcoine",
             extra={
                 "name_of_service": "Placila",
                 "crud_method": "post",
                 "directions": "in",
-                "ip_node": socket.gethostbyname(socket.gethostname()),
+                "ip_node": ip_node,
                 "status": "success",
                 "http_code": None,
             },
         )
-        values.insert(4, bitcoins)
-        self.cur.execute(
-            """INSERT INTO {0} (id, id_placnika, id_prejemnika, znesek_eur, znesek_coin, status)
-                VALUES ({1}, {2}, {3}, '{4}', '{5}', '{6}')""".format(
-                "placila", *values
+        if key is not None and not idempotency.claim(self.cur, key, digest):
+            # A request with the same key committed while this one converted
+            self.conn.rollback()
+            stored = idempotency.lookup(self.cur, key, digest)
+            self.conn.rollback()
+            if stored is None:
+                abort(409, "Zahtevek s tem Idempotency-Key se se izvaja")
+            return self.replay(stored)
+        try:
+            insert_placilo(
+                self.cur,
+                args["id"],
+                args["id_placnika"],
+                args["id_prejemnika"],
+                args["znesek_eur"],
+                bitcoins,
+                args["status"],
             )
-        )
-        self.conn.commit()
-
+        except pg.errors.UniqueViolation:
+            self.conn.rollback()
+            l.warning(
+                "Placilo z ID %s ze obstaja" % str(args["id"]),
+                extra={
+                    "name_of_service": "Placila",
+                    "crud_method": "post",
+                    "directions": "out",
+                    "ip_node": ip_node,
+                    "status": "fail",
+                    "http_code": 409,
+                },
+            )
+            abort(409, "Placilo z ID %s ze obstaja" % args["id"])
         placilo = PlaciloModel(
             id=args["id"],
             id_placnika=args["id_placnika"],
@@ -562,6 +1201,14 @@ class ListPlacil(Resource):
             znesek_coin=bitcoins,
             status=args["status"].strip(),
         )
+        if key is not None:
+            entry, expires_in = idempotency.save(
+                self.cur, key, digest, 201, marshal(placilo, placiloApiModel)
+            )
+        self.conn.commit()
+        placilo_cache.invalidate(args["id"])
+        if key is not None:
+            idempotency.cache.set(key, entry, ttl=expires_in)
 
         l.info(
             "Placilo dodano",
@@ -569,21 +1216,615 @@ class ListPlacil(Resource):
                 "name_of_service": "Placila",
                 "crud_method": "post",
                 "directions": "out",
-                "ip_node": socket.gethostbyname(socket.gethostname()),
+                "ip_node": ip_node,
                 "status": "success",
                 "http_code": 201,
             },
         )
         return placilo, 201
 
+    def replay(self, stored):
+        status, body = stored
+        l.info(
+            "Placilo ze dodano z istim Idempotency-Key",
+            extra={
+                "name_of_service": "Placila",
+                "crud_method": "post",
+                "directions": "out",
+                "ip_node": ip_node,
+                "status": "success",
+                "http_code": status,
+            },
+        )
+        return body, status, {"Idempotent-Replayed": "true"}
+
+
+class PaketPlacil(PlacilaResource):
+    def __init__(self, *args, **kwargs):
+        self.table_name = "placila"
+
+        super(PaketPlacil, self).__init__(*args, **kwargs)
+
+    def read_items(self):
+        if request.mimetype == "application/x-ndjson":
+            items = []
+            for line in request.stream:
+                line = line.strip()
+                if line:
+                    items.append(json.loads(line))
+            return items
+        items = request.get_json(force=True)
+        if not isinstance(items, list):
+            abort(400, "Pricakovana je JSON tabela placil")
+        return items
+
+    @marshal_with(paketApiModel)
+    @ns.expect([placiloApiModel])
+    @ns.response(400, "Neveljaven paket placil")
+    @ns.doc("Dodaj paket placil")
+    def post(self):
+        """
+        Dodaj vec placil naenkrat, kot JSON tabelo ali NDJSON
+        """
+        l.info(
+            "Dodaj paket placil",
+            extra={
+                "name_of_service": "Placila",
+                "crud_method": "post",
+                "directions": "in",
+                "ip_node": ip_node,
+                "status": None,
+                "http_code": None,
+            },
+        )
+        try:
+            items = self.read_items()
+        except ValueError:
+            abort(400, "Paket placil ni veljaven JSON")
+        if len(items) > int(current_app.config["BATCH_MAX_SIZE"]):
+            abort(
+                400,
+                "Paket lahko vsebuje najvec %s placil"
+                % current_app.config["BATCH_MAX_SIZE"],
+            )
+
+        rezultati = []
+        veljavna = []
+        for indeks, item in enumerate(items):
+            rezultat = {"indeks": indeks, "id": None, "koda": 201}
+            try:
+                placilo = PlaciloModel(
+                    id=int(item["id"]),
+                    id_placnika=int(item["id_placnika"]),
+                    id_prejemnika=int(item["id_prejemnika"]),
+                    znesek_eur=str(item["znesek_eur"]).strip(),
+                    znesek_coin=None,
+                    status=str(item["status"]).strip(),
+                )
+                payment_amount(placilo.znesek_eur)
+                if placilo.status not in STATUSES:
+                    raise ValueError("status %s ni veljaven" % placilo.status)
+            except (KeyError, TypeError, ValueError) as e:
+                rezultat["koda"] = 400
+                rezultat["sporocilo"] = "Neveljavno placilo: %s" % e
+            else:
+                rezultat["id"] = placilo.id
+                rezultat["placilo"] = placilo
+                veljavna.append(rezultat)
+            rezultati.append(rezultat)
+
+        bitcoins, napake = convert_amounts(r["placilo"].znesek_eur for r in veljavna)
+        vrstice = []
+        for rezultat in veljavna:
+            placilo = rezultat["placilo"]
+            if placilo.znesek_eur in napake:
+                rezultat["koda"] = 502
+                rezultat["sporocilo"] = napake[placilo.znesek_eur]
+                rezultat["placilo"] = None
+                continue
+            placilo.znesek_coin = format(bitcoins[placilo.znesek_eur], "f")
+            vrstice.append(
+                (
+                    placilo.id,
+                    placilo.id_placnika,
+                    placilo.id_prejemnika,
+                    placilo.znesek_eur,
+                    placilo.znesek_coin,
+                    placilo.status,
+                )
+            )
+
+        dodani = set()
+        if vrstice:
+            dodani = set(
+                row[0]
+                for row in execute_values(
+                    self.cur,
+                    """INSERT INTO placila (id, id_placnika, id_prejemnika, znesek_eur, znesek_coin, status)
+                        VALUES %s ON CONFLICT (id) DO NOTHING RETURNING id""",
+                    vrstice,
+                    page_size=len(vrstice),
+                    fetch=True,
+                )
+            )
+            self.conn.commit()
+            for i in dodani:
+                placilo_cache.invalidate(i)
+
+        for rezultat in veljavna:
+            if rezultat["koda"] == 201 and rezultat["id"] not in dodani:
+                rezultat["koda"] = 409
+                rezultat["sporocilo"] = "Placilo z ID %s ze obstaja" % rezultat["id"]
+                rezultat["placilo"] = None
+            elif rezultat["koda"] == 201:
+                # An id repeated within the batch is only inserted once
+                dodani.discard(rezultat["id"])
+
+        l.info(
+            "Dodanih placil iz paketa: %s" % len(vrstice),
+            extra={
+                "name_of_service": "Placila",
+                "crud_method": "post",
+                "directions": "out",
+                "ip_node": ip_node,
+                "status": "success",
+                "http_code": 200,
+            },
+        )
+        return {"rezultati": rezultati}, 200
+
+
+class DogodkiPlacil(Resource):
+    @ns.expect(dogodkiParser)
+    @ns.response(200, "Spremembe placil kot server-sent events")
+    @ns.response(503, "Prevec narocnikov")
+    @ns.doc("Spremljaj spremembe placil")
+    def get(self):
+        """
+        Posiljaj spremembe placil, ki ustrezajo filtrom, kot server-sent events
+        """
+        l.info(
+            "Spremljaj spremembe placil",
+            extra={
+                "name_of_service": "Placila",
+                "crud_method": "get",
+                "directions": "in",
+                "ip_node": ip_node,
+                "status": None,
+                "http_code": None,
+            },
+        )
+        args = dogodkiParser.parse_args()
+        filters = {k: v for k, v in args.items() if v is not None}
+        subscription = changefeed.subscribe(filters)
+        heartbeat = float(current_app.config["CHANGEFEED_HEARTBEAT"])
+
+        def generate():
+            try:
+                yield "retry: 3000\n\n"
+                while not subscription.closed:
+                    event = subscription.get(heartbeat)
+                    if event is None:
+                        # Keeps proxies from closing the stream and notices
+                        # clients that went away
+                        yield ": ping\n\n"
+                    else:
+                        yield "event: %s\ndata: %s\n\n" % (
+                            event["op"],
+                            json.dumps(event),
+                        )
+            finally:
+                changefeed.unsubscribe(subscription)
+
+        return Response(
+            generate(),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+
+class PovzetekPlacil(PlacilaResource):
+    @marshal_with(povzetekApiModel)
+    @ns.expect(summaryParser)
+    @ns.doc("Povzetek placil")
+    def get(self):
+        """
+        Vrni stevilo in vsote placil po placnikih, prejemnikih ali statusih
+        """
+        l.info(
+            "Zahtevaj povzetek placil",
+            extra={
+                "name_of_service": "Placila",
+                "crud_method": "get",
+                "directions": "in",
+                "ip_node": ip_node,
+                "status": None,
+                "http_code": None,
+            },
+        )
+        args = summaryParser.parse_args()
+        column = args["group_by"]
+        conditions, params = filter_conditions(args)
+        self.read_cur.execute(
+            """SELECT {0}, count(*), sum(znesek_eur), sum(znesek_coin)
+                FROM placila{1} GROUP BY {0} ORDER BY {0}""".format(
+                column, where_clause(conditions)
+            ),
+            params,
+        )
+        povzetek = []
+        for skupina, stevilo, znesek_eur, znesek_coin in self.read_cur.fetchall():
+            povzetek.append(
+                {
+                    "skupina": str(skupina),
+                    "stevilo": stevilo,
+                    "znesek_eur": format(znesek_eur or 0, "f"),
+                    "znesek_coin": format(znesek_coin or 0, "f"),
+                }
+            )
+
+        l.info(
+            "Vrni povzetek placil",
+            extra={
+                "name_of_service": "Placila",
+                "crud_method": "get",
+                "directions": "out",
+                "ip_node": ip_node,
+                "status": "success",
+                "http_code": 200,
+            },
+        )
+        return {"povzetek": povzetek}, 200
+
 
-health = HealthCheck()
 envdump = EnvironmentDump()
-health.add_check(check_database_connection)
 envdump.add_section("application", application_data)
-app.add_url_rule("/healthcheck", "healthcheck", view_func=lambda: health.run())
-app.add_url_rule("/environment", "environment", view_func=lambda: envdump.run())
 api.add_resource(ListPlacil, "/placila")
 api.add_resource(Placilo, "/placila/<int:id>")
-app.run(host="0.0.0.0", port=5002)
-h.close()
+api.add_resource(PaketPlacil, "/placila/batch")
+api.add_resource(PovzetekPlacil, "/placila/povzetek")
+api.add_resource(DogodkiPlacil, "/placila/dogodki")
+
+
+def create_log_handler(app):
+    if app.config["LOG_MODE"] == "queue":
+        h = BatchingFluentHandler(
+            "Placila",
+            host=app.config["FLUENT_IP"],
+            port=int(app.config["FLUENT_PORT"]),
+            maxsize=int(app.config["LOG_QUEUE_SIZE"]),
+            batch_size=int(app.config["LOG_BATCH_SIZE"]),
+            flush_interval=float(app.config["LOG_FLUSH_INTERVAL"]),
+            policy=app.config["LOG_QUEUE_POLICY"],
+        )
+    else:
+        h = handler.FluentHandler(
+            "Placila", host=app.config["FLUENT_IP"], port=int(app.config["FLUENT_PORT"])
+        )
+    h.setFormatter(formatter)
+    return h
+
+
+def create_pool(app, name, **connect_kwargs):
+    return ConnectionPool(
+        minconn=int(app.config["DB_POOL_MIN"]),
+        maxconn=int(app.config["DB_POOL_MAX"]),
+        timeout=float(app.config["DB_POOL_TIMEOUT"]),
+        validate_after=float(app.config["DB_POOL_VALIDATE_IDLE"]),
+        name=name,
+        connection_factory=PreparedConnection,
+        **connect_kwargs,
+    )
+
+
+def init_services(app):
+    """
+    Create the logging handler, database pool and gRPC clients of this process
+
+    Nothing here waits for a dependency; connections are opened by
+    warm_up on a background thread, and readiness waits for it.
+    """
+    global h, db_pool, converter, batcher, rate_cache, placilo_cache, prevozi
+    global dispatcher, prober, ip_node, idempotency, changefeed, router
+
+    started = time.perf_counter()
+    with startup_phase("dns"):
+        ip_node = socket.gethostbyname(socket.gethostname())
+    with startup_phase("logging"):
+        h = create_log_handler(app)
+        l.logger.addHandler(h)
+    l.info(
+        "Pripravljanje Placila Mikrostoritve",
+        extra={
+            "name_of_service": "Placila",
+            "crud_method": None,
+            "directions": None,
+            "ip_node": ip_node,
+            "status": None,
+            "http_code": None,
+        },
+    )
+
+    connect_kwargs = dict(
+        database=app.config["PGDATABASE"],
+        user=app.config["PGUSER"],
+        password=app.config["PGPASSWORD"],
+        port=app.config["DATABASE_PORT"],
+        host=app.config["DATABASE_IP"],
+    )
+    with startup_phase("database"):
+        db_pool = create_pool(app, "primary", **connect_kwargs)
+        replicas = {}
+        for host, port in parse_replicas(app.config["DATABASE_REPLICAS"]):
+            port = port or connect_kwargs["port"]
+            name = "%s:%s" % (host, port)
+            replicas[name] = create_pool(
+                app, name, **dict(connect_kwargs, host=host, port=port)
+            )
+        router = ReplicaRouter(
+            db_pool,
+            replicas,
+            max_lag=float(app.config["REPLICA_MAX_LAG"]),
+            interval=float(app.config["REPLICA_CHECK_INTERVAL"]),
+            receiver_timeout=float(app.config["REPLICA_RECEIVER_TIMEOUT"]),
+        )
+        router.start()
+    with startup_phase("grpc"):
+        converter = ConverterClient(
+            "{}:{}".format(
+                app.config["GRPC_SERVER_IP"], app.config["GRPC_SERVER_PORT"]
+            ),
+            timeout=float(app.config["GRPC_TIMEOUT"]),
+            max_attempts=int(app.config["GRPC_MAX_ATTEMPTS"]),
+            keepalive_time=float(app.config["GRPC_KEEPALIVE_TIME"]),
+            keepalive_timeout=float(app.config["GRPC_KEEPALIVE_TIMEOUT"]),
+            breaker=CircuitBreaker(
+                "convertToCrypto",
+                failure_threshold=int(app.config["GRPC_BREAKER_THRESHOLD"]),
+                reset_timeout=float(app.config["GRPC_BREAKER_RESET"]),
+            ),
+        )
+        batcher = ConversionBatcher(
+            converter,
+            window=float(app.config["GRPC_BATCH_WINDOW"]),
+            max_batch=int(app.config["GRPC_BATCH_MAX_SIZE"]),
+        )
+        rate_cache = RateCache(
+            batcher,
+            ttl=float(app.config["RATE_CACHE_TTL"]),
+            refresh_interval=float(app.config["RATE_REFRESH_INTERVAL"]),
+        )
+    with startup_phase("http"):
+        prevozi = ServiceClient(
+            "aktivni_prevozi",
+            app.config["AKTIVNI_IP"],
+            connect_timeout=float(app.config["AKTIVNI_CONNECT_TIMEOUT"]),
+            read_timeout=float(app.config["AKTIVNI_READ_TIMEOUT"]),
+            max_retries=int(app.config["AKTIVNI_MAX_RETRIES"]),
+            backoff=float(app.config["AKTIVNI_BACKOFF"]),
+            pool_size=int(app.config["AKTIVNI_POOL_SIZE"]),
+            breaker=CircuitBreaker(
+                "aktivni_prevozi",
+                failure_threshold=int(app.config["AKTIVNI_BREAKER_THRESHOLD"]),
+                reset_timeout=float(app.config["AKTIVNI_BREAKER_RESET"]),
+            ),
+        )
+    placilo_cache = LRUCache(
+        "placilo",
+        maxsize=int(app.config["PLACILO_CACHE_SIZE"]),
+        ttl=float(app.config["PLACILO_CACHE_TTL"]),
+    )
+    idempotency = IdempotencyStore(
+        db_pool,
+        LRUCache(
+            "idempotency",
+            maxsize=int(app.config["IDEMPOTENCY_CACHE_SIZE"]),
+            ttl=float(app.config["IDEMPOTENCY_TTL"]),
+        ),
+        ttl=float(app.config["IDEMPOTENCY_TTL"]),
+        cleanup_interval=float(app.config["IDEMPOTENCY_CLEANUP_INTERVAL"]),
+    )
+    idempotency.start()
+    max_subscribers = int(app.config["CHANGEFEED_MAX_SUBSCRIBERS"])
+    if app.config.get("WORKER_THREADS"):
+        # Every open stream holds one worker thread until the client leaves;
+        # keep at least half of them for other requests, /health/* included.
+        max_subscribers = min(max_subscribers, int(app.config["WORKER_THREADS"]) // 2)
+    changefeed = ChangeFeed(
+        connect_kwargs,
+        queue_size=int(app.config["CHANGEFEED_QUEUE_SIZE"]),
+        max_subscribers=max_subscribers,
+    )
+    # Writes made through other replicas only reach this cache via the feed
+    changefeed.add_listener(lambda event: placilo_cache.invalidate(event["id"]))
+    changefeed.add_listener(lambda event: router.mark_changed(event["id"]))
+    changefeed.on_reconnect(placilo_cache.clear)
+    changefeed.start()
+    dispatcher = OutboxDispatcher(
+        db_pool,
+        {"izbrisi_prevoz": izbrisi_prevoz},
+        batch_size=int(app.config["OUTBOX_BATCH_SIZE"]),
+        interval=float(app.config["OUTBOX_POLL_INTERVAL"]),
+        max_backoff=float(app.config["OUTBOX_MAX_BACKOFF"]),
+        retention=float(app.config["OUTBOX_RETENTION"]),
+        claim_timeout=float(app.config["OUTBOX_CLAIM_TIMEOUT"]),
+        cleanup_interval=float(app.config["OUTBOX_CLEANUP_INTERVAL"]),
+    )
+    profiler.configure(
+        sample_rate=app.config["PROFILE_SAMPLE_RATE"],
+        directory=app.config["PROFILE_DIR"],
+    )
+    prober = HealthProber(interval=float(app.config["HEALTH_INTERVAL"]))
+    # Only the database and the warm-up take an instance out of rotation;
+    # the converter and aktivni_prevozi are down for every instance at
+    # once, and the breakers and the outbox already degrade around them.
+    timeout = float(app.config["HEALTH_TIMEOUT"])
+    prober.add_check("warmup", lambda: (warm.is_set(), "Ogrevanje koncano"))
+    prober.add_check("database", lambda: check_database_connection(timeout))
+    prober.add_check(
+        "convertToCrypto", lambda: check_converter(timeout), critical=False
+    )
+    prober.add_check(
+        "aktivni_prevozi", lambda: check_aktivni_prevozi(timeout), critical=False
+    )
+    if router.replicas:
+        prober.add_check("replicas", check_replicas, critical=False)
+    prober.add_check(
+        "changefeed",
+        lambda: (changefeed.listening, "LISTEN %s" % changefeed.channel),
+        critical=False,
+    )
+    prober.start()
+    STARTUP_PHASE.labels("init").set(time.perf_counter() - started)
+
+    threading.Thread(
+        target=warm_up,
+        args=(app, started),
+        name="warm-up",
+        daemon=True,
+    ).start()
+
+
+warm = threading.Event()
+
+
+def warm_up(app, started):
+    """
+    Open the pooled connections and channels before reporting ready
+    """
+    timeout = float(app.config["WARMUP_TIMEOUT"])
+    with startup_phase("warm_database"):
+        while True:
+            try:
+                ensure_schema(db_pool)
+                conns = [db_pool.getconn() for _ in range(db_pool.minconn)]
+                for conn in conns:
+                    db_pool.putconn(conn)
+                break
+            except (pg.Error, PoolExhausted):
+                time.sleep(1)
+    with startup_phase("warm_grpc"):
+        # The converter is not required to be up; the breaker and the rate
+        # cache handle it being down, so readiness does not wait for it.
+        try:
+            grpc.channel_ready_future(converter.channel).result(timeout=timeout)
+        except grpc.FutureTimeoutError:
+            pass
+        if rate_cache.ttl > 0:
+            rate_cache.start()
+    dispatcher.start()
+    warm.set()
+    STARTUP_PHASE.labels("total").set(time.perf_counter() - started)
+    prober.probe()
+    l.info(
+        "Placila Mikrostoritev pripravljena v %.3fs" % (time.perf_counter() - started),
+        extra={
+            "name_of_service": "Placila",
+            "crud_method": None,
+            "directions": None,
+            "ip_node": ip_node,
+            "status": "success",
+            "http_code": None,
+        },
+    )
+
+
+_services_lock = threading.Lock()
+_services_pid = None
+
+
+def ensure_services(app):
+    """
+    Create the services of this process once, on first use after a fork
+    """
+    global _services_pid
+    if _services_pid == os.getpid():
+        return
+    with _services_lock:
+        if _services_pid != os.getpid():
+            init_services(app)
+            _services_pid = os.getpid()
+
+
+def shutdown_services():
+    """
+    Flush the log handler and close the pool and channels of this process
+    """
+    if prober is not None:
+        prober.stop()
+    if dispatcher is not None:
+        dispatcher.stop()
+    if idempotency is not None:
+        idempotency.stop()
+    if changefeed is not None:
+        changefeed.stop()
+    if router is not None:
+        router.stop()
+        router.close()
+    if converter is not None:
+        converter.close()
+    if prevozi is not None:
+        prevozi.close()
+    if db_pool is not None:
+        db_pool.closeall()
+    if h is not None:
+        l.logger.removeHandler(h)
+        h.close()
+
+
+def profiling():
+    """
+    Show or change the share of requests profiled by this worker
+    """
+    token = current_app.config["PROFILE_TOKEN"]
+    if not token or request.headers.get("X-Profile-Token") != token:
+        return {"message": "Profiliranje ni omogoceno"}, 404
+    if request.method == "PUT":
+        args = request.get_json(force=True, silent=True) or {}
+        try:
+            profiler.configure(sample_rate=args.get("sample_rate"))
+        except (TypeError, ValueError):
+            return {"message": "sample_rate mora biti stevilo med 0 in 1"}, 400
+    return {
+        "pid": os.getpid(),
+        "sample_rate": profiler.sample_rate,
+        "directory": profiler.directory,
+    }
+
+
+def create_app():
+    """
+    Build the Flask application without touching any dependency
+
+    The clients of each process are created by ensure_services, from the
+    gunicorn post_fork hook or on the first request.
+    """
+    app = Flask(__name__)
+    with startup_phase("config"):
+        load_configurations(app)
+    with startup_phase("app"):
+        app.add_url_rule("/", "welcome", welcome)
+        app.add_url_rule(
+            "/healthcheck", "healthcheck", view_func=lambda: prober.healthy()
+        )
+        app.add_url_rule("/health/live", "live", view_func=lambda: prober.live())
+        app.add_url_rule("/health/ready", "ready", view_func=lambda: prober.ready())
+        app.add_url_rule("/environment", "environment", view_func=lambda: envdump.run())
+        app.add_url_rule(
+            "/debug/profiling", "profiling", profiling, methods=["GET", "PUT"]
+        )
+        app.before_request(lambda: ensure_services(app))
+        app.before_request(profiler.start)
+        app.after_request(profiler.stop)
+        app.after_request(pin_to_primary)
+        app.teardown_appcontext(return_db)
+        api.init_app(app)
+        metrics.init_app(app)
+    return app
+
+
+if __name__ == "__main__":
+    app = create_app()
+    ensure_services(app)
+    app.run(host="0.0.0.0", port=5002)
+    shutdown_services()
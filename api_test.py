@@ -1,5 +1,6 @@
 import json
 import unittest
+import uuid
 import requests
 
 class TestAPI(unittest.TestCase):
@@ -20,5 +21,95 @@ class TestAPI(unittest.TestCase):
         resp = requests.delete(self.placila + "/placila/1")
         self.assertEqual(resp.status_code, 200)
 
+    def test_4_list_placila_limit(self):
+        resp = requests.get(self.placila + "/placila", {"limit": 1})
+        self.assertEqual(resp.status_code, 200)
+        self.assertLessEqual(len(resp.json()["placila"]), 1)
+
+    def test_4_stream_invalid_filter(self):
+        resp = requests.get(self.placila + "/placila", {"stream": "ndjson", "status": "bogus"})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_5_batch_placila(self):
+        placila = [
+            {"id": 100, "id_placnika": 2, "id_prejemnika": 3, "znesek_eur": "10.00", "status": "neplacano"},
+            {"id": 100, "id_placnika": 2, "id_prejemnika": 3, "znesek_eur": "10.00", "status": "neplacano"},
+            {"id": 103, "id_placnika": 2, "id_prejemnika": 3, "znesek_eur": "10.00", "status": "preklicano"},
+        ]
+        resp = requests.post(self.placila + "/placila/batch", json=placila)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([r["koda"] for r in resp.json()["rezultati"]], [201, 409, 400])
+        resp = requests.delete(self.placila + "/placila", json={"ids": [100]})
+        self.assertEqual(resp.json()["izbrisani"], [100])
+
+    def test_11_delete_ids_must_be_list(self):
+        for ids in ("123", {"1": 1}, [1, "2"]):
+            resp = requests.delete(self.placila + "/placila", json={"ids": ids})
+            self.assertEqual(resp.status_code, 400)
+
+    def test_6_idempotent_post(self):
+        placilo = {"id": 101, "id_placnika": 2, "id_prejemnika": 3, "znesek_eur": "10.00", "status": "neplacano"}
+        headers = {"Idempotency-Key": "test-6-%s" % uuid.uuid4()}
+        first = requests.post(self.placila + "/placila", placilo, headers=headers)
+        self.assertEqual(first.status_code, 201)
+        replay = requests.post(self.placila + "/placila", placilo, headers=headers)
+        self.assertEqual(replay.status_code, 201)
+        self.assertEqual(replay.json(), first.json())
+        self.assertEqual(replay.headers.get("Idempotent-Replayed"), "true")
+        placilo["znesek_eur"] = "20.00"
+        resp = requests.post(self.placila + "/placila", placilo, headers=headers)
+        self.assertEqual(resp.status_code, 422)
+        resp = requests.delete(self.placila + "/placila/101")
+        self.assertEqual(resp.status_code, 200)
+
+    def test_7_put_not_updatable(self):
+        resp = requests.put(self.placila + "/placila/1", {"atribut": "id = 2; --", "vrednost": "1"})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_8_patch_placila(self):
+        placilo = {"id": 102, "id_placnika": 2, "id_prejemnika": 3, "znesek_eur": "10.00", "status": "neplacano"}
+        resp = requests.post(self.placila + "/placila", placilo)
+        self.assertEqual(resp.status_code, 201)
+        etag = requests.get(self.placila + "/placila/102").headers["ETag"]
+        resp = requests.patch(self.placila + "/placila/102", json={"id_prejemnika": 7, "znesek_eur": "12.50"}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual((resp.json()["id_prejemnika"], resp.json()["znesek_eur"]), (7, "12.50"))
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        resp = requests.patch(self.placila + "/placila/102", json={"status": "neplacano"}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, 412)
+        resp = requests.patch(self.placila + "/placila/102", json={"znesek_eur": "NaN"})
+        self.assertEqual(resp.status_code, 400)
+        resp = requests.put(self.placila + "/placila/102", {"atribut": "znesek_coin", "vrednost": "-5"})
+        self.assertEqual(resp.status_code, 400)
+        resp = requests.delete(self.placila + "/placila/102")
+        self.assertEqual(resp.status_code, 200)
+
+    def test_9_dogodki_placila(self):
+        resp = requests.post(self.placila + "/placila", {"id": 104, "id_placnika": 2, "id_prejemnika": 3, "znesek_eur": "10.00", "status": "neplacano"})
+        self.assertEqual(resp.status_code, 201)
+        stream = requests.get(self.placila + "/placila/dogodki", {"id": 104}, stream=True, timeout=10)
+        self.assertEqual(stream.headers["Content-Type"].split(";")[0], "text/event-stream")
+        lines = stream.iter_lines(chunk_size=1, decode_unicode=True)
+        self.assertEqual(next(lines), "retry: 3000")
+        resp = requests.patch(self.placila + "/placila/104", json={"znesek_eur": "11.00"})
+        self.assertEqual(resp.status_code, 200)
+        data = next(line for line in lines if line.startswith("data: "))
+        self.assertEqual(json.loads(data[len("data: "):])["znesek_eur"], "11.00")
+        stream.close()
+        resp = requests.delete(self.placila + "/placila/104")
+        self.assertEqual(resp.status_code, 200)
+    def test_10_post_duplicate_placilo(self):
+        placilo = {"id": 105, "id_placnika": 2, "id_prejemnika": 3, "znesek_eur": "10.00", "status": "neplacano"}
+        resp = requests.post(self.placila + "/placila", placilo)
+        self.assertEqual(resp.status_code, 201)
+        resp = requests.post(self.placila + "/placila", placilo)
+        self.assertEqual(resp.status_code, 409)
+        for znesek in ("NaN", "Infinity", "-10.00", "0"):
+            placilo.update(id=106, znesek_eur=znesek)
+            resp = requests.post(self.placila + "/placila", placilo)
+            self.assertEqual(resp.status_code, 400)
+        resp = requests.delete(self.placila + "/placila/105")
+        self.assertEqual(resp.status_code, 200)
+
 if __name__ == '__main__':
     unittest.main()
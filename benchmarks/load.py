@@ -0,0 +1,406 @@
+"""
+Load test for the Placila API
+
+Starts the stand-in services from benchmarks.stand_ins, runs the API
+against them and the PostgreSQL database configured through the usual
+DATABASE_IP, DATABASE_PORT, PGDATABASE, PGUSER and PGPASSWORD variables,
+then drives a weighted mix of requests and reports throughput and
+latency percentiles per endpoint:
+
+    python -m benchmarks.load --duration 30 --concurrency 16 \\
+        --mix get=50,list=20,post=10,put=10,delete=10 --json run.json
+    python -m benchmarks.load --compare baseline.json run.json
+
+With --rate the load is open loop: requests are sent on a fixed schedule
+and latency is measured from the scheduled start, so a stalled server
+shows up in the percentiles instead of just slowing the clients down.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from benchmarks.stand_ins import StandIns
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPERATIONS = ("get", "list", "post", "put", "delete", "batch", "summary")
+DEFAULT_MIX = "get=50,list=20,post=10,put=10,delete=10"
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError("unknown operation %r" % name)
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    k = max(0, min(len(values) - 1, int(round(p / 100.0 * len(values))) - 1))
+    return values[k]
+
+
+def start_api(server, port, env, workers, threads):
+    if server == "gunicorn":
+        cmd = [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-c",
+            "gunicorn.conf.py",
+            "-b",
+            "127.0.0.1:%d" % port,
+            "wsgi:app",
+        ]
+        env = dict(env, GUNICORN_WORKERS=str(workers), GUNICORN_THREADS=str(threads))
+    else:
+        cmd = [
+            sys.executable,
+            "-c",
+            "import api; api.create_app().run(host='127.0.0.1', port=%d, "
+            "threaded=True)" % port,
+        ]
+    proc = subprocess.Popen(
+        cmd,
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = "http://127.0.0.1:%d" % port
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("API exited with code %s" % proc.returncode)
+        try:
+            if requests.get(url + "/", timeout=1).status_code == 200:
+                return proc, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("API did not start within 30s")
+
+
+class Workload(object):
+    """
+    Shared state of the load: ids that exist and ids that are free
+
+    Every run uses ids from its own range starting at `base`, so runs do
+    not collide with each other or with existing data.
+    """
+
+    def __init__(self, url, base, seed_rows):
+        self.url = url
+        self.base = base
+        self.lock = threading.Lock()
+        self.next_id = itertools.count(base + seed_rows)
+        self.live = list(range(base, base + seed_rows))
+
+    def payload(self, id):
+        return {
+            "id": id,
+            "id_placnika": id % 97,
+            "id_prejemnika": id % 89,
+            "znesek_eur": "%d.%02d" % (id % 1000, id % 100),
+            "status": "neplacano",
+        }
+
+    def seed(self, session):
+        for start in range(0, len(self.live), 1000):
+            chunk = self.live[start : start + 1000]
+            resp = session.post(
+                self.url + "/placila/batch", json=[self.payload(i) for i in chunk]
+            )
+            resp.raise_for_status()
+
+    def cleanup(self, session):
+        last = next(self.next_id)
+        ids = list(range(self.base, last))
+        for start in range(0, len(ids), 5000):
+            session.delete(
+                self.url + "/placila", json={"ids": ids[start : start + 5000]}
+            )
+
+    def pick(self):
+        with self.lock:
+            return random.choice(self.live) if self.live else None
+
+    def take(self):
+        with self.lock:
+            if not self.live:
+                return None
+            i = random.randrange(len(self.live))
+            self.live[i], self.live[-1] = self.live[-1], self.live[i]
+            return self.live.pop()
+
+    def add(self, id):
+        with self.lock:
+            self.live.append(id)
+
+    def request(self, session, op):
+        """
+        Send one request of the given kind and return (endpoint, ok)
+        """
+        if op == "get":
+            resp = session.get("%s/placila/%s" % (self.url, self.pick()))
+            return "GET /placila/<id>", resp.status_code in (200, 304, 404)
+        if op == "list":
+            resp = session.get(
+                self.url + "/placila",
+                params={"limit": 50, "after": self.pick() or 0},
+            )
+            return "GET /placila", resp.status_code == 200
+        if op == "summary":
+            resp = session.get(
+                self.url + "/placila/povzetek", params={"group_by": "status"}
+            )
+            return "GET /placila/povzetek", resp.status_code == 200
+        if op == "post":
+            id = next(self.next_id)
+            resp = session.post(self.url + "/placila", data=self.payload(id))
+            if resp.status_code == 201:
+                self.add(id)
+            return "POST /placila", resp.status_code == 201
+        if op == "batch":
+            ids = [next(self.next_id) for _ in range(50)]
+            resp = session.post(
+                self.url + "/placila/batch", json=[self.payload(i) for i in ids]
+            )
+            if resp.status_code == 200:
+                for i in ids:
+                    self.add(i)
+            return "POST /placila/batch", resp.status_code == 200
+        if op == "put":
+            id = self.pick()
+            resp = session.put(
+                "%s/placila/%s" % (self.url, id),
+                data={
+                    "atribut": "status",
+                    "vrednost": random.choice(("placano", "neplacano")),
+                },
+            )
+            return "PUT /placila/<id>", resp.status_code == 200
+        if op == "delete":
+            id = self.take()
+            resp = session.delete("%s/placila/%s" % (self.url, id))
+            return "DELETE /placila/<id>", resp.status_code in (200, 204)
+        raise ValueError(op)
+
+
+def run_load(workload, mix, concurrency, duration, rate):
+    ops, weights = zip(*mix.items())
+    samples = []
+    samples_lock = threading.Lock()
+    start = time.monotonic()
+    stop_at = start + duration
+    # With a target rate each client sends at fixed intervals
+    interval = concurrency / float(rate) if rate else 0
+
+    def client(n):
+        session = requests.Session()
+        local = []
+        scheduled = start + (interval * n / concurrency if interval else 0)
+        while True:
+            now = time.monotonic()
+            if interval:
+                if scheduled > now:
+                    time.sleep(scheduled - now)
+                t0 = scheduled
+                scheduled += interval
+            else:
+                t0 = now
+            if t0 >= stop_at:
+                break
+            op = random.choices(ops, weights)[0]
+            try:
+                endpoint, ok = workload.request(session, op)
+            except requests.RequestException:
+                endpoint, ok = op, False
+            local.append((endpoint, time.monotonic() - t0, ok))
+        with samples_lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, time.monotonic() - start
+
+
+def summarize(samples, elapsed):
+    def stats(rows):
+        latencies = sorted(latency for _, latency, _ in rows)
+        return {
+            "requests": len(rows),
+            "errors": sum(1 for _, _, ok in rows if not ok),
+            "rps": len(rows) / elapsed,
+            "mean_ms": 1000 * sum(latencies) / len(latencies),
+            "p50_ms": 1000 * percentile(latencies, 50),
+            "p95_ms": 1000 * percentile(latencies, 95),
+            "p99_ms": 1000 * percentile(latencies, 99),
+            "max_ms": 1000 * latencies[-1],
+        }
+
+    endpoints = {}
+    for row in samples:
+        endpoints.setdefault(row[0], []).append(row)
+    result = {name: stats(rows) for name, rows in sorted(endpoints.items())}
+    if samples:
+        result["total"] = stats(samples)
+    return result
+
+
+def print_table(result, out=sys.stdout):
+    header = "%-24s %9s %7s %9s %9s %9s %9s" % (
+        "endpoint",
+        "requests",
+        "errors",
+        "rps",
+        "p50 ms",
+        "p95 ms",
+        "p99 ms",
+    )
+    out.write(header + "\n")
+    for name, s in result.items():
+        out.write(
+            "%-24s %9d %7d %9.1f %9.2f %9.2f %9.2f\n"
+            % (
+                name,
+                s["requests"],
+                s["errors"],
+                s["rps"],
+                s["p50_ms"],
+                s["p95_ms"],
+                s["p99_ms"],
+            )
+        )
+
+
+def compare(baseline_path, current_path, out=sys.stdout):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["endpoints"]
+    with open(current_path) as f:
+        current = json.load(f)["endpoints"]
+    out.write("%-24s %18s %18s %18s\n" % ("endpoint", "rps", "p95 ms", "p99 ms"))
+    for name in current:
+        if name not in baseline:
+            continue
+        cells = []
+        for key in ("rps", "p95_ms", "p99_ms"):
+            old, new = baseline[name][key], current[name][key]
+            change = (new - old) / old * 100 if old else 0.0
+            cells.append("%9.1f (%+6.1f%%)" % (new, change))
+        out.write("%-24s %s\n" % (name, " ".join(cells)))
+
+
+def git_revision():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=ROOT,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate", type=float, help="target requests per second")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--seed-rows", type=int, default=1000)
+    parser.add_argument("--server", choices=("gunicorn", "flask"), default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--url", help="benchmark a running API instead")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        help="compare two result files and exit",
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    stand_ins = proc = None
+    url = args.url
+    if url is None:
+        stand_ins = StandIns()
+        env = dict(os.environ, **stand_ins.start())
+        proc, url = start_api(args.server, free_port(), env, args.workers, args.threads)
+
+    try:
+        workload = Workload(url, random.randrange(10**8, 2 * 10**8), args.seed_rows)
+        session = requests.Session()
+        workload.seed(session)
+        if args.warmup:
+            run_load(workload, args.mix, args.concurrency, args.warmup, args.rate)
+        samples, elapsed = run_load(
+            workload, args.mix, args.concurrency, args.duration, args.rate
+        )
+        workload.cleanup(session)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+        if stand_ins is not None:
+            stand_ins.stop()
+
+    result = summarize(samples, elapsed)
+    print_table(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "revision": git_revision(),
+                    "timestamp": time.time(),
+                    "settings": {
+                        "duration": args.duration,
+                        "concurrency": args.concurrency,
+                        "rate": args.rate,
+                        "mix": args.mix,
+                        "server": args.server if args.url is None else args.url,
+                        "workers": args.workers,
+                        "threads": args.threads,
+                    },
+                    "endpoints": result,
+                },
+                f,
+                indent=4,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Measure what prepared statements save on point lookups
+
+Looks up random placila by id through three connections to the database
+configured in config.json and the environment: with the id formatted into
+the SQL text the way Placilo.load used to, with psycopg2 bound parameters,
+and with queries.get_placilo, which prepares the statement once per
+connection. Reports lookup latency and the planning time PostgreSQL
+spends per statement:
+
+    python -m benchmarks.prepared --rows 100000 --lookups 20000 --json prep.json
+
+The rows are written to a temporary table that shadows placila for the
+benchmark's sessions only, so the real table is never touched.
+"""
+
+import argparse
+import json
+import random
+import time
+
+import psycopg2
+
+from api import create_app
+from database import PreparedConnection, migrate
+from queries import SELECT_COLUMNS, get_placilo
+
+QUERY = "SELECT {} FROM placila WHERE id = ".format(SELECT_COLUMNS)
+
+
+def connect(config):
+    conn = psycopg2.connect(
+        database=config["PGDATABASE"],
+        user=config["PGUSER"],
+        password=config["PGPASSWORD"],
+        port=config["DATABASE_PORT"],
+        host=config["DATABASE_IP"],
+        connection_factory=PreparedConnection,
+    )
+    with conn.cursor() as cur:
+        cur.execute("CREATE TEMP TABLE placila (LIKE public.placila INCLUDING ALL)")
+    conn.commit()
+    return conn
+
+
+def fill(conn, rows):
+    with conn.cursor() as cur:
+        cur.execute(
+            """INSERT INTO placila
+               SELECT i, i %% 97, i %% 89, i %% 1000, 0.0234, 'neplacano'::status_placila
+               FROM generate_series(1, %s) i""",
+            (rows,),
+        )
+        cur.execute("ANALYZE placila")
+    conn.commit()
+
+
+def literal(cur, id):
+    cur.execute(QUERY + "%s" % str(id))
+    return cur.fetchone()
+
+
+def bound(cur, id):
+    cur.execute(QUERY + "%s", (id,))
+    return cur.fetchone()
+
+
+def prepared(cur, id):
+    return get_placilo(cur, id)
+
+
+def planning_time(cur, statement):
+    cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + statement)
+    return cur.fetchone()[0][0]["Planning Time"]
+
+
+def measure(conn, lookup, ids):
+    latencies = []
+    with conn.cursor() as cur:
+        for id in ids[:100]:
+            lookup(cur, id)
+        for id in ids:
+            start = time.perf_counter()
+            lookup(cur, id)
+            latencies.append(time.perf_counter() - start)
+        conn.rollback()
+    latencies.sort()
+    return {
+        "mean_ms": 1000 * sum(latencies) / len(latencies),
+        "p50_ms": 1000 * latencies[len(latencies) // 2],
+        "p99_ms": 1000 * latencies[int(len(latencies) * 0.99)],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    config = create_app().config
+    setup = psycopg2.connect(
+        database=config["PGDATABASE"],
+        user=config["PGUSER"],
+        password=config["PGPASSWORD"],
+        port=config["DATABASE_PORT"],
+        host=config["DATABASE_IP"],
+    )
+    migrate(setup)
+    setup.close()
+
+    rng = random.Random(0)
+    ids = [rng.randint(1, args.rows) for _ in range(args.lookups)]
+    result = {"rows": args.rows, "lookups": args.lookups}
+    for name, lookup in (
+        ("literal", literal),
+        ("bound", bound),
+        ("prepared", prepared),
+    ):
+        conn = connect(config)
+        fill(conn, args.rows)
+        result[name] = measure(conn, lookup, ids)
+        with conn.cursor() as cur:
+            if name == "prepared":
+                statement = "EXECUTE placilo_po_id (%d)" % ids[0]
+            else:
+                statement = QUERY + str(ids[0])
+            result[name]["planning_ms"] = planning_time(cur, statement)
+        conn.close()
+
+    print(
+        "%-9s %9s %9s %9s %12s" % ("path", "mean ms", "p50 ms", "p99 ms", "planning ms")
+    )
+    for name in ("literal", "bound", "prepared"):
+        r = result[name]
+        print(
+            "%-9s %9.4f %9.4f %9.4f %12.4f"
+            % (name, r["mean_ms"], r["p50_ms"], r["p99_ms"], r["planning_ms"])
+        )
+    print(
+        "prepared lookups %.1f%% faster than bound parameters"
+        % (100 * (1 - result["prepared"]["mean_ms"] / result["bound"]["mean_ms"]))
+    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Compare the list response path before and after the fast row encoder
+
+Serializes synthetic placila rows, shaped like the cursor returns them,
+once the way ListPlacil.get used to (dict per row, dict-of-dicts,
+PlaciloModel objects, marshal, json.dumps) and once with
+serialization.encode_placila. Reports CPU time and memory allocated:
+
+    python -m benchmarks.serialization --rows 100000 --json ser.json
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+from decimal import Decimal
+
+from flask_restx import marshal
+
+from api import PlaciloModel, placilaApiModel
+from serialization import encode_placila
+
+# The column mapping the handlers used before the fast path
+POLJA = ("id", "id_placnika", "id_prejemnika", "znesek_eur", "znesek_coin", "status")
+
+
+def make_rows(n):
+    """
+    Rows as the cursor returns them: CHAR(20) text before the NUMERIC
+    migration, Decimal amounts after it
+    """
+    legacy_rows = []
+    rows = []
+    for i in range(n):
+        eur = "%d.%02d" % (i % 1000, i % 100)
+        legacy_rows.append(
+            (
+                i,
+                i % 97,
+                i % 89,
+                eur.ljust(20),
+                "0.0234000".ljust(20),
+                "neplacano".ljust(20),
+            )
+        )
+        rows.append(
+            (i, i % 97, i % 89, Decimal(eur), Decimal("0.0234000"), "neplacano")
+        )
+    return legacy_rows, rows
+
+
+def legacy(rows):
+    ds = {}
+    i = 0
+    for row in rows:
+        ds[i] = {}
+        for el, k in zip(row, POLJA):
+            ds[i][k] = el
+        i += 1
+    placila = []
+    for d in ds:
+        placila.append(
+            PlaciloModel(
+                id=ds[d]["id"],
+                id_placnika=ds[d]["id_placnika"],
+                id_prejemnika=ds[d]["id_prejemnika"],
+                znesek_eur=ds[d]["znesek_eur"].strip(),
+                znesek_coin=ds[d]["znesek_coin"].strip(),
+                status=ds[d]["status"].strip(),
+            )
+        )
+    return json.dumps(marshal({"placila": placila, "naslednji": None}, placilaApiModel))
+
+
+def fast(rows):
+    return encode_placila(rows)
+
+
+def measure(fn, rows, repeat):
+    cpu = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn(rows)
+        cpu.append(time.process_time() - start)
+    tracemalloc.start()
+    fn(rows)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"cpu_s": min(cpu), "peak_mib": peak / 2.0**20}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    legacy_rows, rows = make_rows(args.rows)
+    if json.loads(legacy(legacy_rows[:1000])) != json.loads(fast(rows[:1000])):
+        raise SystemExit("encode_placila output differs from marshal")
+
+    result = {
+        "rows": args.rows,
+        "legacy": measure(legacy, legacy_rows, args.repeat),
+        "fast": measure(fast, rows, args.repeat),
+    }
+    print("%-8s %10s %10s" % ("path", "cpu s", "peak MiB"))
+    for name in ("legacy", "fast"):
+        r = result[name]
+        print("%-8s %10.3f %10.1f" % (name, r["cpu_s"], r["peak_mib"]))
+    print(
+        "cpu %.1fx faster, peak memory %.1fx lower"
+        % (
+            result["legacy"]["cpu_s"] / result["fast"]["cpu_s"],
+            result["legacy"]["peak_mib"] / result["fast"]["peak_mib"],
+        )
+    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Local stand-ins for the services the Placila API depends on
+"""
+
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from grpc_test_server import serve as serve_converter
+
+
+class AktivniPrevoziHandler(BaseHTTPRequestHandler):
+    """
+    Answers like aktivni_prevozi for a prevoz that was delivered
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, code, body=b""):
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        id = self.path.rstrip("/").rsplit("/", 1)[-1]
+        self._send(200, json.dumps({"id": int(id), "prejeto": "Da"}).encode())
+
+    def do_DELETE(self):
+        self._send(204)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_aktivni_prevozi(port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), AktivniPrevoziHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_port
+
+
+def serve_fluent_sink(port=0):
+    """
+    Accept Fluentd forward connections and discard everything sent
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", port))
+    sock.listen(64)
+
+    def drain(conn):
+        with conn:
+            while conn.recv(65536):
+                pass
+
+    def accept():
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=drain, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return sock, sock.getsockname()[1]
+
+
+class StandIns(object):
+    """
+    Starts the fake convertToCrypto, aktivni_prevozi and Fluentd services
+    and returns the environment that points the API at them
+    """
+
+    def start(self):
+        self.grpc_server, self.converter, grpc_port = serve_converter()
+        self.http_server, http_port = serve_aktivni_prevozi()
+        self.fluent_sock, fluent_port = serve_fluent_sink()
+        return {
+            "GRPC_SERVER_IP": "127.0.0.1",
+            "GRPC_SERVER_PORT": str(grpc_port),
+            "AKTIVNI_IP": "http://127.0.0.1:{}/".format(http_port),
+            "FLUENT_IP": "127.0.0.1",
+            "FLUENT_PORT": str(fluent_port),
+        }
+
+    def stop(self):
+        self.grpc_server.stop(None)
+        self.http_server.shutdown()
+        self.http_server.server_close()
+        self.fluent_sock.close()
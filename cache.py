@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter, Gauge
+
+CACHE_HITS = Counter("placila_cache_hits_total", "Cache hits", ["cache"])
+CACHE_MISSES = Counter("placila_cache_misses_total", "Cache misses", ["cache"])
+CACHE_EVICTIONS = Counter(
+    "placila_cache_evictions_total", "Cache evictions", ["cache", "reason"]
+)
+CACHE_SIZE = Gauge("placila_cache_size", "Entries held in the cache", ["cache"])
+
+
+class LRUCache(object):
+    """
+    Thread-safe LRU cache whose entries expire `ttl` seconds after being set
+
+    A `maxsize` of 0 disables the cache. set() can give an entry a shorter
+    `ttl` than the cache's, e.g. to end with the record it copies. To cache
+    a value loaded while the
+    key may be invalidated concurrently, take generation(key) before
+    loading and pass it to set, which then ignores the value if the key was
+    invalidated in between.
+    """
+
+    def __init__(self, name, maxsize, ttl):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        CACHE_SIZE.labels(name).set_function(lambda: len(self._data))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    CACHE_HITS.labels(self.name).inc()
+                    return value
+                del self._data[key]
+                CACHE_EVICTIONS.labels(self.name, "expired").inc()
+        CACHE_MISSES.labels(self.name).inc()
+        return None
+
+    def generation(self, key):
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def set(self, key, value, generation=None, ttl=None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != (
+                self._epoch,
+                self._generations.get(key, 0),
+            ):
+                return
+            if ttl is None or ttl > self.ttl:
+                ttl = self.ttl
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                CACHE_EVICTIONS.labels(self.name, "size").inc()
+
+    def invalidate(self, key):
+        with self._lock:
+            if len(self._generations) >= max(self.maxsize, 1) * 2:
+                # A new epoch outdates every generation handed out so far
+                self._generations.clear()
+                self._epoch += 1
+            self._generations[key] = self._generations.get(key, 0) + 1
+            if self._data.pop(key, None) is not None:
+                CACHE_EVICTIONS.labels(self.name, "invalidated").inc()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generations.clear()
+            self._epoch += 1
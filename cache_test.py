@@ -0,0 +1,41 @@
+import time
+import unittest
+
+from cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = LRUCache("test", maxsize=2, ttl=60)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set(1, "a")
+        self.cache.set(2, "b")
+        self.cache.get(1)
+        self.cache.set(3, "c")
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.get(1), "a")
+
+    def test_entry_ttl_is_capped(self):
+        self.cache.set(1, "a", ttl=0)
+        self.cache.set(2, "b", ttl=3600)
+        self.assertIsNone(self.cache.get(1))
+        self.assertLessEqual(self.cache._data[2][0] - time.monotonic(), 60)
+
+    def test_value_loaded_before_invalidation_is_not_cached(self):
+        generation = self.cache.generation(1)
+        self.cache.invalidate(1)
+        self.cache.set(1, "star", generation)
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, "nov", self.cache.generation(1))
+        self.assertEqual(self.cache.get(1), "nov")
+
+    def test_clear_outdates_generations(self):
+        generation = self.cache.generation(1)
+        self.cache.clear()
+        self.cache.set(1, "star", generation)
+        self.assertIsNone(self.cache.get(1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,211 @@
+import json
+import logging
+import queue
+import select
+import threading
+
+import psycopg2
+from prometheus_client import Counter, Gauge
+
+CHANGEFEED_EVENTS = Counter(
+    "placila_changefeed_events_total", "Change notifications received", ["op"]
+)
+CHANGEFEED_SUBSCRIBERS = Gauge(
+    "placila_changefeed_subscribers", "Clients subscribed to the change feed"
+)
+CHANGEFEED_DROPPED = Counter(
+    "placila_changefeed_dropped_total",
+    "Subscribers disconnected because they fell too far behind",
+)
+CHANGEFEED_RECONNECTS = Counter(
+    "placila_changefeed_reconnects_total", "Times the LISTEN connection was reopened"
+)
+
+# Columns a subscription can filter on
+FILTERS = ("id", "id_placnika", "id_prejemnika", "status")
+
+log = logging.getLogger("Placila")
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscription(object):
+    """
+    Changes matching `filters`, buffered until the subscriber reads them
+
+    A subscriber that lets `maxsize` events pile up is closed instead of
+    holding back the feed; its client reconnects and reads the rows again.
+    """
+
+    def __init__(self, filters, maxsize):
+        self.filters = filters
+        self.closed = False
+        self._events = queue.Queue(maxsize)
+
+    def matches(self, event):
+        return all(event.get(k) == v for k, v in self.filters.items())
+
+    def put(self, event):
+        try:
+            self._events.put_nowait(event)
+        except queue.Full:
+            CHANGEFEED_DROPPED.inc()
+            self.close()
+
+    def close(self):
+        self.closed = True
+        try:
+            self._events.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def get(self, timeout):
+        """
+        Return the next event, or None after `timeout` seconds or once closed
+        """
+        try:
+            return self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class ChangeFeed(object):
+    """
+    Shares one LISTEN connection per process between all subscribers
+
+    The placila trigger sends every insert, update and delete as a NOTIFY
+    on `channel`. Listeners added with add_listener see every event, for
+    example to invalidate caches, and on_reconnect callbacks run whenever
+    the connection is reopened, since notifications sent while it was down
+    are lost. The connection is reopened after `retry` seconds.
+    """
+
+    def __init__(
+        self,
+        connect_kwargs,
+        channel="placila",
+        queue_size=100,
+        max_subscribers=100,
+        retry=1.0,
+    ):
+        self.connect_kwargs = connect_kwargs
+        self.channel = channel
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.retry = retry
+        self.listening = False
+        self._listeners = []
+        self._reconnect_callbacks = []
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def on_reconnect(self, callback):
+        self._reconnect_callbacks.append(callback)
+
+    def subscribe(self, filters):
+        with self._lock:
+            if len(self._subscriptions) >= self.max_subscribers:
+                raise TooManySubscribers()
+            subscription = Subscription(filters, self.queue_size)
+            self._subscriptions.add(subscription)
+            CHANGEFEED_SUBSCRIBERS.set(len(self._subscriptions))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+            CHANGEFEED_SUBSCRIBERS.set(len(self._subscriptions))
+
+    def publish(self, event):
+        CHANGEFEED_EVENTS.labels(event.get("op")).inc()
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception:
+                log.exception(
+                    "Poslusalec sprememb placil ni uspel",
+                    extra={
+                        "name_of_service": "Placila",
+                        "crud_method": None,
+                        "directions": None,
+                        "ip_node": None,
+                        "status": "fail",
+                        "http_code": None,
+                    },
+                )
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.matches(event):
+                subscription.put(event)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="changefeed", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.close()
+
+    def _run(self):
+        first = True
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.connect_kwargs)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute("LISTEN {}".format(self.channel))
+                self.listening = True
+                if not first:
+                    CHANGEFEED_RECONNECTS.inc()
+                    for callback in self._reconnect_callbacks:
+                        callback()
+                first = False
+                self._listen(conn)
+            except Exception as e:
+                log.warning(
+                    "Povezava za spremembe placil je prekinjena: %s",
+                    e,
+                    extra={
+                        "name_of_service": "Placila",
+                        "crud_method": None,
+                        "directions": None,
+                        "ip_node": None,
+                        "status": "fail",
+                        "http_code": None,
+                    },
+                )
+            finally:
+                self.listening = False
+                if conn is not None:
+                    conn.close()
+            self._stopped.wait(self.retry)
+
+    def _listen(self, conn):
+        while not self._stopped.is_set():
+            # Wake up now and then to notice stop() and dead connections
+            if select.select([conn], [], [], 1.0) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                try:
+                    event = json.loads(notify.payload)
+                except ValueError:
+                    continue
+                self.publish(event)
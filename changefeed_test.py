@@ -0,0 +1,51 @@
+import unittest
+
+from changefeed import ChangeFeed, TooManySubscribers
+
+
+class TestChangeFeed(unittest.TestCase):
+    def setUp(self):
+        self.feed = ChangeFeed({}, queue_size=2, max_subscribers=2)
+
+    def event(self, id, status="placano"):
+        return {"op": "update", "id": id, "id_placnika": 1, "status": status}
+
+    def test_subscribers_only_see_matching_changes(self):
+        subscription = self.feed.subscribe({"id": 1, "status": "placano"})
+        self.feed.publish(self.event(2))
+        self.feed.publish(self.event(1, "neplacano"))
+        self.feed.publish(self.event(1))
+        self.assertEqual(subscription.get(0), self.event(1))
+        self.assertIsNone(subscription.get(0))
+
+    def test_listeners_see_every_change(self):
+        ids = []
+        self.feed.add_listener(lambda event: ids.append(event["id"]))
+        self.feed.publish(self.event(1))
+        self.feed.publish(self.event(2))
+        self.assertEqual(ids, [1, 2])
+
+    def test_failing_listener_is_logged(self):
+        ids = []
+        self.feed.add_listener(lambda event: 1 / 0)
+        self.feed.add_listener(lambda event: ids.append(event["id"]))
+        with self.assertLogs("Placila", "ERROR"):
+            self.feed.publish(self.event(1))
+        self.assertEqual(ids, [1])
+
+    def test_slow_subscriber_is_closed(self):
+        subscription = self.feed.subscribe({})
+        for id in range(3):
+            self.feed.publish(self.event(id))
+        self.assertTrue(subscription.closed)
+
+    def test_subscribers_are_limited(self):
+        self.feed.subscribe({})
+        subscription = self.feed.subscribe({})
+        self.assertRaises(TooManySubscribers, self.feed.subscribe, {})
+        self.feed.unsubscribe(subscription)
+        self.feed.subscribe({})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,480 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from psycopg2 import extensions
+from psycopg2 import pool as pg_pool
+from prometheus_client import Counter, Gauge, Histogram
+
+from instrumentation import stage
+
+POOL_SIZE = Gauge(
+    "placila_db_pool_size", "Maximum number of pooled database connections", ["pool"]
+)
+POOL_OPEN = Gauge(
+    "placila_db_pool_open",
+    "Database connections currently opened by the pool",
+    ["pool"],
+)
+POOL_IN_USE = Gauge(
+    "placila_db_pool_in_use",
+    "Database connections currently borrowed from the pool",
+    ["pool"],
+)
+POOL_WAIT = Histogram(
+    "placila_db_pool_wait_seconds",
+    "Time spent waiting for a pooled database connection",
+    ["pool"],
+)
+POOL_EXHAUSTED = Counter(
+    "placila_db_pool_exhausted_total",
+    "Checkouts that gave up because every pooled connection was in use",
+    ["pool"],
+)
+POOL_DISCARDED = Counter(
+    "placila_db_pool_discarded_total",
+    "Pooled connections discarded because they failed validation",
+    ["pool"],
+)
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class MigrationError(Exception):
+    pass
+
+
+class TimedCursor(extensions.cursor):
+    """
+    Cursor that records statement execution as the "db" request stage
+    """
+
+    def execute(self, query, vars=None):
+        with stage("db"):
+            return super(TimedCursor, self).execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        with stage("db"):
+            return super(TimedCursor, self).executemany(query, vars_list)
+
+
+class TimedConnection(extensions.connection):
+    """
+    Connection whose cursors, commits and rollbacks are timed as "db"
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TimedConnection, self).__init__(*args, **kwargs)
+        self.cursor_factory = TimedCursor
+
+    def commit(self):
+        with stage("db"):
+            return super(TimedConnection, self).commit()
+
+    def rollback(self):
+        with stage("db"):
+            return super(TimedConnection, self).rollback()
+
+
+class PreparedConnection(TimedConnection):
+    """
+    Connection that prepares each named statement once, on first use
+
+    psycopg2 interpolates parameters on the client, so the server would
+    parse and plan every statement again. Statements run through
+    execute_prepared are sent once as PREPARE and then only as EXECUTE,
+    letting PostgreSQL reuse the plan. Prepared statements outlive
+    rollbacks and last as long as the connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PreparedConnection, self).__init__(*args, **kwargs)
+        self.prepared = set()
+
+    def execute_prepared(self, cur, name, statement, params):
+        if name not in self.prepared:
+            cur.execute("PREPARE {} AS {}".format(name, statement))
+            self.prepared.add(name)
+        if params:
+            cur.execute(
+                "EXECUTE {} ({})".format(name, ", ".join(["%s"] * len(params))),
+                params,
+            )
+        else:
+            cur.execute("EXECUTE {}".format(name))
+
+
+class ConnectionPool(object):
+    """
+    Process-wide pool of PostgreSQL connections
+
+    Checkouts block for at most `timeout` seconds when all `maxconn`
+    connections are borrowed. Connections that sat idle for longer than
+    `validate_after` seconds are pinged before they are handed out. The
+    pool's metrics are labelled with its `name`.
+    """
+
+    def __init__(
+        self,
+        minconn,
+        maxconn,
+        timeout,
+        validate_after,
+        name="primary",
+        **connect_kwargs
+    ):
+        self.name = name
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.validate_after = validate_after
+        self.connect_kwargs = connect_kwargs
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._last_used = {}
+        POOL_SIZE.labels(name).set(maxconn)
+        POOL_OPEN.labels(name).set_function(self._open_connections)
+
+    def _open_connections(self):
+        pool = self._pool
+        if pool is None or pool.closed:
+            return 0
+        return len(pool._pool) + len(pool._used)
+
+    def _get_pool(self):
+        # The pool is opened on first use so that importing the application
+        # does not require a reachable database.
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = pg_pool.ThreadedConnectionPool(
+                        self.minconn, self.maxconn, **self.connect_kwargs
+                    )
+        return self._pool
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.validate_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+        except Exception:
+            return False
+        return True
+
+    def getconn(self, timeout=None):
+        start = time.monotonic()
+        if timeout is None:
+            timeout = self.timeout
+        if not self._slots.acquire(timeout=timeout):
+            POOL_EXHAUSTED.labels(self.name).inc()
+            raise PoolExhausted(
+                "No database connection available after {}s".format(timeout)
+            )
+        try:
+            pool = self._get_pool()
+            conn = pool.getconn()
+            while not self._is_healthy(conn):
+                POOL_DISCARDED.labels(self.name).inc()
+                self._last_used.pop(id(conn), None)
+                pool.putconn(conn, close=True)
+                # With no idle connection left the pool opens a new one,
+                # which needs no validation
+                fresh = not pool._pool
+                conn = pool.getconn()
+                if fresh:
+                    break
+        except Exception:
+            self._slots.release()
+            raise
+        POOL_WAIT.labels(self.name).observe(time.monotonic() - start)
+        POOL_IN_USE.labels(self.name).inc()
+        return conn
+
+    def putconn(self, conn):
+        close = bool(conn.closed)
+        if (
+            not close
+            and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE
+        ):
+            try:
+                conn.rollback()
+            except Exception:
+                close = True
+        if close:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+        try:
+            self._get_pool().putconn(conn, close=close)
+        finally:
+            POOL_IN_USE.labels(self.name).dec()
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._lock:
+            if self._pool is not None and not self._pool.closed:
+                self._pool.closeall()
+            self._pool = None
+            self._last_used.clear()
+
+
+STATUSES = ("neplacano", "placano")
+# Amounts used to be stored as str(response)[10:17], which kept the closing
+# quote of messages shorter than seven characters.
+AMOUNT_TEXT = "rtrim(trim({0}), '\"')"
+NUMERIC_TEXT = "CASE WHEN {0} ~ '^-?[0-9]+(\\.[0-9]+)?$' THEN {0}::numeric END".format(
+    AMOUNT_TEXT
+)
+
+
+def check_amounts(cur):
+    """
+    Refuse to convert the amount columns while any amount is not a number
+
+    Truncated messages such as "2.34e-0" can not be recovered and would
+    otherwise become NULL.
+    """
+    cur.execute(
+        "SELECT id FROM placila WHERE "
+        "({0} <> '' AND {1} IS NULL) OR ({2} <> '' AND {3} IS NULL) ORDER BY id".format(
+            AMOUNT_TEXT.format("znesek_eur"),
+            NUMERIC_TEXT.format("znesek_eur"),
+            AMOUNT_TEXT.format("znesek_coin"),
+            NUMERIC_TEXT.format("znesek_coin"),
+        )
+    )
+    ids = [str(id) for (id,) in cur.fetchall()]
+    if ids:
+        raise MigrationError(
+            "Amounts of placila {} are not numbers; fix them before the "
+            "columns can become NUMERIC".format(", ".join(ids))
+        )
+
+
+def create_status_type(cur):
+    """
+    Create the status enum from the known statuses and any others in use
+    """
+    cur.execute(
+        "SELECT DISTINCT trim(status) FROM placila WHERE trim(status) <> '' "
+        "ORDER BY 1"
+    )
+    statuses = list(STATUSES)
+    statuses += [s for (s,) in cur.fetchall() if s not in statuses]
+    cur.execute(
+        "CREATE TYPE status_placila AS ENUM (%s)" % ", ".join(["%s"] * len(statuses)),
+        statuses,
+    )
+
+
+# Schema migrations, applied in order and recorded in schema_migrations.
+# Every step runs in one transaction under an advisory lock so that
+# concurrently starting workers apply each migration exactly once.
+MIGRATION_LOCK = 5002
+MIGRATIONS = [
+    (
+        1,
+        [
+            """CREATE TABLE IF NOT EXISTS placila (
+                   id INT NOT NULL,
+                   id_placnika INT NOT NULL,
+                   id_prejemnika INT NOT NULL,
+                   znesek_eur CHAR(20),
+                   znesek_coin CHAR(20),
+                   status CHAR(20)
+               )""",
+        ],
+    ),
+    (
+        2,
+        [
+            # Tables created before this migration had no key. The first row
+            # of any duplicated id stays, the others are moved to
+            # placila_duplikati to be reviewed by hand.
+            """CREATE TABLE IF NOT EXISTS placila_duplikati
+               (LIKE placila, premaknjeno TIMESTAMPTZ NOT NULL DEFAULT now())""",
+            """WITH odvecna AS (
+                   DELETE FROM placila a USING placila b
+                   WHERE a.id = b.id AND a.ctid > b.ctid
+                   RETURNING a.*)
+               INSERT INTO placila_duplikati
+                   (id, id_placnika, id_prejemnika, znesek_eur, znesek_coin, status)
+               SELECT id, id_placnika, id_prejemnika, znesek_eur, znesek_coin, status
+               FROM odvecna""",
+            "ALTER TABLE placila ADD PRIMARY KEY (id)",
+            "CREATE INDEX IF NOT EXISTS placila_id_placnika_idx ON placila (id_placnika)",
+            "CREATE INDEX IF NOT EXISTS placila_id_prejemnika_idx ON placila (id_prejemnika)",
+            "CREATE INDEX IF NOT EXISTS placila_status_idx ON placila (status)",
+        ],
+    ),
+    (
+        3,
+        [
+            # Filtered pages are read in id order and summaries add up the
+            # amounts, so each filter column gets an index on (column, id)
+            # that also covers the amounts for index-only scans.
+            """CREATE INDEX IF NOT EXISTS placila_id_placnika_id_idx
+               ON placila (id_placnika, id) INCLUDE (znesek_eur, znesek_coin)""",
+            """CREATE INDEX IF NOT EXISTS placila_id_prejemnika_id_idx
+               ON placila (id_prejemnika, id) INCLUDE (znesek_eur, znesek_coin)""",
+            """CREATE INDEX IF NOT EXISTS placila_status_id_idx
+               ON placila (status, id) INCLUDE (znesek_eur, znesek_coin)""",
+            "DROP INDEX IF EXISTS placila_id_placnika_idx",
+            "DROP INDEX IF EXISTS placila_id_prejemnika_idx",
+            "DROP INDEX IF EXISTS placila_status_idx",
+        ],
+    ),
+    (
+        4,
+        [
+            # Side effects on other services are recorded in the same
+            # transaction as the change that causes them and delivered by
+            # outbox.OutboxDispatcher.
+            """CREATE TABLE IF NOT EXISTS outbox (
+                   id BIGSERIAL PRIMARY KEY,
+                   kind TEXT NOT NULL,
+                   key TEXT NOT NULL,
+                   payload JSONB NOT NULL,
+                   created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                   attempts INT NOT NULL DEFAULT 0,
+                   next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                   last_error TEXT,
+                   sent_at TIMESTAMPTZ
+               )""",
+            """CREATE UNIQUE INDEX IF NOT EXISTS outbox_pending_key_idx
+               ON outbox (kind, key) WHERE sent_at IS NULL""",
+            """CREATE INDEX IF NOT EXISTS outbox_due_idx
+               ON outbox (next_attempt_at, id) WHERE sent_at IS NULL""",
+        ],
+    ),
+    (
+        5,
+        [
+            create_status_type,
+            check_amounts,
+            # Only empty amounts become NULL; check_amounts stops the
+            # migration on any other amount that is not a number
+            """ALTER TABLE placila
+                   ALTER COLUMN znesek_eur TYPE NUMERIC USING {0},
+                   ALTER COLUMN znesek_coin TYPE NUMERIC USING {1},
+                   ALTER COLUMN status TYPE status_placila
+                       USING NULLIF(trim(status), '')::status_placila""".format(
+                NUMERIC_TEXT.format("znesek_eur"), NUMERIC_TEXT.format("znesek_coin")
+            ),
+        ],
+    ),
+    (
+        6,
+        [
+            # Responses of requests sent with an Idempotency-Key, see
+            # idempotency.IdempotencyStore. status is NULL while the
+            # request that claimed the key is still running.
+            """CREATE TABLE IF NOT EXISTS idempotency_keys (
+                   key TEXT PRIMARY KEY,
+                   fingerprint TEXT NOT NULL,
+                   status INT,
+                   response JSONB,
+                   created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+               )""",
+            """CREATE INDEX IF NOT EXISTS idempotency_keys_created_at_idx
+               ON idempotency_keys (created_at)""",
+        ],
+    ),
+    (
+        7,
+        [
+            # Every change to placila is sent to the placila channel when
+            # its transaction commits, see changefeed.ChangeFeed. Amounts are
+            # sent as strings, like the API returns them.
+            """CREATE OR REPLACE FUNCTION placila_notify() RETURNS trigger AS $$
+               DECLARE
+                   r placila;
+               BEGIN
+                   IF TG_OP = 'DELETE' THEN r := OLD; ELSE r := NEW; END IF;
+                   PERFORM pg_notify('placila', json_build_object(
+                       'op', lower(TG_OP),
+                       'id', r.id,
+                       'id_placnika', r.id_placnika,
+                       'id_prejemnika', r.id_prejemnika,
+                       'znesek_eur', r.znesek_eur::text,
+                       'znesek_coin', r.znesek_coin::text,
+                       'status', r.status
+                   )::text);
+                   RETURN NULL;
+               END
+               $$ LANGUAGE plpgsql""",
+            "DROP TRIGGER IF EXISTS placila_notify ON placila",
+            """CREATE TRIGGER placila_notify
+               AFTER INSERT OR UPDATE OR DELETE ON placila
+               FOR EACH ROW EXECUTE PROCEDURE placila_notify()""",
+        ],
+    ),
+    (
+        8,
+        [
+            # OutboxDispatcher.cleanup deletes delivered events by sent_at
+            """CREATE INDEX IF NOT EXISTS outbox_sent_at_idx
+               ON outbox (sent_at) WHERE sent_at IS NOT NULL""",
+        ],
+    ),
+]
+
+
+def migrate(conn):
+    """
+    Apply all pending schema migrations on the given connection
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK,))
+        cur.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+                   version INT PRIMARY KEY,
+                   applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+               )""")
+        cur.execute("SELECT version FROM schema_migrations")
+        applied = set(row[0] for row in cur.fetchall())
+        for version, statements in MIGRATIONS:
+            if version in applied:
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(cur)
+                else:
+                    cur.execute(statement)
+            cur.execute(
+                "INSERT INTO schema_migrations (version) VALUES (%s)", (version,)
+            )
+    conn.commit()
+
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def ensure_schema(pool):
+    """
+    Run the migrations once per process, on the first connection checkout
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            with pool.connection() as conn:
+                migrate(conn)
+            _schema_ready = True
@@ -0,0 +1,149 @@
+import unittest
+from unittest import mock
+
+import psycopg2
+from psycopg2 import extensions
+
+import database
+from database import ConnectionPool, PoolExhausted
+
+
+class FakeCursor(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, vars=None):
+        self.conn.pings += 1
+        if self.conn.dead:
+            raise psycopg2.OperationalError("server closed the connection")
+        self.conn.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.closed = 0
+        self.dead = False
+        self.pings = 0
+        self.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+        self.info = self
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        if self.dead:
+            raise psycopg2.OperationalError("server closed the connection")
+        self.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeThreadedPool(object):
+    """
+    Stand-in for psycopg2's ThreadedConnectionPool
+    """
+
+    def __init__(self, minconn, maxconn, **connect_kwargs):
+        self.closed = False
+        self._pool = []
+        self._used = {}
+
+    def getconn(self):
+        if self._pool:
+            conn = self._pool.pop()
+        else:
+            conn = FakeConnection()
+        self._used[id(conn)] = conn
+        return conn
+
+    def putconn(self, conn, close=False):
+        del self._used[id(conn)]
+        if close:
+            conn.close()
+        else:
+            self._pool.append(conn)
+
+    def closeall(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(
+            database.pg_pool, "ThreadedConnectionPool", FakeThreadedPool
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = ConnectionPool(1, 2, 0.01, 60, name="test")
+
+    def discarded(self):
+        return database.POOL_DISCARDED.labels("test")._value.get()
+
+    def test_recently_used_connection_is_not_pinged(self):
+        conn = self.pool.getconn()
+        self.pool.putconn(conn)
+        pings = conn.pings
+        self.assertIs(self.pool.getconn(), conn)
+        self.assertEqual(conn.pings, pings)
+
+    def test_idle_connection_is_validated(self):
+        conn = self.pool.getconn()
+        self.pool.putconn(conn)
+        self.pool.validate_after = 0
+        pings = conn.pings
+        self.assertIs(self.pool.getconn(), conn)
+        self.assertEqual(conn.pings, pings + 1)
+
+    def test_every_dead_connection_is_replaced(self):
+        conns = [self.pool.getconn(), self.pool.getconn()]
+        for conn in conns:
+            self.pool.putconn(conn)
+            conn.dead = True
+        self.pool.validate_after = 0
+        discarded = self.discarded()
+        conn = self.pool.getconn()
+        self.assertNotIn(conn, conns)
+        self.assertFalse(conn.closed)
+        self.assertTrue(all(c.closed for c in conns))
+        self.assertEqual(self.discarded() - discarded, 2)
+
+    def test_checkouts_are_limited_to_maxconn(self):
+        first = self.pool.getconn()
+        self.pool.getconn()
+        self.assertRaises(PoolExhausted, self.pool.getconn)
+        self.pool.putconn(first)
+        self.pool.getconn()
+
+    def test_failed_checkout_releases_its_slot(self):
+        with mock.patch.object(
+            FakeThreadedPool, "getconn", side_effect=RuntimeError("connect")
+        ):
+            for _ in range(3):
+                self.assertRaises(RuntimeError, self.pool.getconn)
+        self.pool.getconn()
+        self.pool.getconn()
+
+    def test_connection_in_a_transaction_is_rolled_back(self):
+        conn = self.pool.getconn()
+        conn.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+        self.pool.putconn(conn)
+        self.assertEqual(conn.transaction_status, extensions.TRANSACTION_STATUS_IDLE)
+        self.assertFalse(conn.closed)
+
+    def test_connection_that_can_not_roll_back_is_closed(self):
+        conn = self.pool.getconn()
+        conn.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+        conn.dead = True
+        self.pool.putconn(conn)
+        self.assertTrue(conn.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
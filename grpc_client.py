@@ -1,9 +1,249 @@
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent import futures
+from decimal import Context, Decimal, InvalidOperation
+
 import grpc
+from prometheus_client import Counter, Gauge, Histogram
 import unary_pb2_grpc as pb2_grpc
 import unary_pb2 as pb2
+from resilience import CircuitBreaker
+
+log = logging.getLogger('Placila')
+
+
+class ConversionFailed(Exception):
+    pass
+
+# Status codes that count against the circuit breaker; anything else is
+# an answer from a healthy converter.
+BREAKER_CODES = (
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+)
+
+RPC_LATENCY = Histogram(
+    'placila_grpc_latency_seconds',
+    'Latency of convertToCrypto rpcs', ['method'])
+RPC_ERRORS = Counter(
+    'placila_grpc_errors_total',
+    'Failed convertToCrypto rpcs', ['method', 'code'])
+
+CHANNEL_STATE = Gauge(
+    'placila_grpc_channel_state',
+    'Connectivity of the gRPC channel (0 idle, 1 connecting, 2 ready, '
+    '3 transient failure, 4 shutdown)', ['target'])
+CHANNEL_STATES = {
+    grpc.ChannelConnectivity.IDLE: 0,
+    grpc.ChannelConnectivity.CONNECTING: 1,
+    grpc.ChannelConnectivity.READY: 2,
+    grpc.ChannelConnectivity.TRANSIENT_FAILURE: 3,
+    grpc.ChannelConnectivity.SHUTDOWN: 4,
+}
+
+RATE_CACHE_HITS = Counter(
+    'placila_rate_cache_hits_total',
+    'Conversions computed locally from the cached exchange rate')
+RATE_CACHE_MISSES = Counter(
+    'placila_rate_cache_misses_total',
+    'Conversions that fell back to the convertToBitcoin rpc')
+RATE_AGE = Gauge(
+    'placila_rate_cache_age_seconds',
+    'Age of the cached EUR to BTC exchange rate')
+
+
+def channel_options(max_attempts, keepalive_time, keepalive_timeout):
+    """
+    Channel arguments with keepalive pings and a retry service config
+
+    Pings are only sent while calls are open. A server rejects pings
+    arriving more often than its
+    grpc.http2.min_ping_interval_without_data_ms (five minutes by default)
+    with GOAWAY too_many_pings, so `keepalive_time` must not be shorter
+    than what the converter allows.
+    """
+    service_config = {
+        'methodConfig': [{
+            'name': [{'service': 'Placila.convertToCrypto'}],
+            'retryPolicy': {
+                'maxAttempts': max_attempts,
+                'initialBackoff': '0.05s',
+                'maxBackoff': '1s',
+                'backoffMultiplier': 2,
+                'retryableStatusCodes': ['UNAVAILABLE'],
+            },
+        }],
+    }
+    return [
+        ('grpc.enable_retries', 1),
+        ('grpc.service_config', json.dumps(service_config)),
+        ('grpc.keepalive_time_ms', int(keepalive_time * 1000)),
+        ('grpc.keepalive_timeout_ms', int(keepalive_timeout * 1000)),
+    ]
+
+
+class ConverterClient(object):
+    """
+    Shared client for the convertToCrypto service
+
+    Every call has a deadline of `timeout` seconds, UNAVAILABLE calls are
+    retried by the channel, and a circuit breaker stops calling the
+    service while it keeps failing.
+    """
+
+    def __init__(self, target, timeout=2.0, max_attempts=3, keepalive_time=300,
+                 keepalive_timeout=10, breaker=None):
+        self.target = target
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker('convertToCrypto')
+        self.channel = grpc.insecure_channel(
+            target, options=channel_options(
+                max_attempts, keepalive_time, keepalive_timeout))
+        self.stub = pb2_grpc.convertToCryptoStub(self.channel)
+        self._batch_supported = True
+        self.state = grpc.ChannelConnectivity.IDLE
+        self.channel.subscribe(self._on_state_change)
+
+    def _on_state_change(self, connectivity):
+        self.state = connectivity
+        CHANNEL_STATE.labels(self.target).set(CHANNEL_STATES[connectivity])
+
+    def _call(self, method, request):
+        self.breaker.before_call()
+        start = time.monotonic()
+        try:
+            response = getattr(self.stub, method)(request, timeout=self.timeout)
+        except grpc.RpcError as e:
+            RPC_ERRORS.labels(method, e.code().name).inc()
+            if e.code() in BREAKER_CODES:
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+            raise
+        finally:
+            RPC_LATENCY.labels(method).observe(time.monotonic() - start)
+        self.breaker.success()
+        return response
+
+    def convert(self, eur):
+        return self._call('convertToBitcoin', pb2.Message(message=eur))
+
+    def convert_many(self, amounts):
+        amounts = list(amounts)
+        if not amounts:
+            return []
+        if not self._batch_supported:
+            responses = [self.convert(eur) for eur in amounts]
+            for response in responses:
+                # The unary rpc reports failures as errors
+                response.received = True
+            return responses
+        message = pb2.BatchMessage(messages=amounts)
+        try:
+            responses = list(
+                self._call('convertToBitcoinBatch', message).responses)
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                raise
+            # Older converters only serve the unary rpc
+            self._batch_supported = False
+            return self.convert_many(amounts)
+        if len(responses) != len(amounts):
+            raise ConversionFailed(
+                'Converter answered {} of {} amounts'.format(
+                    len(responses), len(amounts)))
+        return responses
+
+    def stream(self, amounts):
+        """
+        Convert an iterable of amounts over one bidirectional stream
+        """
+        self.breaker.before_call()
+        messages = (pb2.Message(message=eur) for eur in amounts)
+        return self._stream_responses(
+            self.stub.convertToBitcoinStream(messages, timeout=self.timeout))
+
+    def _stream_responses(self, call):
+        # The stream's outcome settles the breaker like a unary call's, so
+        # a stream let through as the half-open trial does not leave the
+        # breaker waiting for it
+        method = 'convertToBitcoinStream'
+        start = time.monotonic()
+        try:
+            for response in call:
+                yield response
+        except grpc.RpcError as e:
+            RPC_ERRORS.labels(method, e.code().name).inc()
+            if e.code() in BREAKER_CODES:
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+            raise
+        except GeneratorExit:
+            call.cancel()
+            self.breaker.success()
+            raise
+        finally:
+            RPC_LATENCY.labels(method).observe(time.monotonic() - start)
+        self.breaker.success()
+
+    def close(self):
+        self.channel.unsubscribe(self._on_state_change)
+        CHANNEL_STATE.labels(self.target).set(
+            CHANNEL_STATES[grpc.ChannelConnectivity.SHUTDOWN])
+        self.channel.close()
+
+
+class AsyncConverterClient(object):
+    """
+    grpc.aio variant of ConverterClient for use inside an asyncio loop
+    """
+
+    def __init__(self, target, timeout=2.0, max_attempts=3, keepalive_time=300,
+                 keepalive_timeout=10, breaker=None):
+        self.target = target
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker('convertToCrypto-aio')
+        self.channel = grpc.aio.insecure_channel(
+            target, options=channel_options(
+                max_attempts, keepalive_time, keepalive_timeout))
+        self.stub = pb2_grpc.convertToCryptoStub(self.channel)
+
+    async def _call(self, method, request):
+        self.breaker.before_call()
+        start = time.monotonic()
+        try:
+            response = await getattr(self.stub, method)(
+                request, timeout=self.timeout)
+        except grpc.RpcError as e:
+            RPC_ERRORS.labels(method, e.code().name).inc()
+            if e.code() in BREAKER_CODES:
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+            raise
+        finally:
+            RPC_LATENCY.labels(method).observe(time.monotonic() - start)
+        self.breaker.success()
+        return response
+
+    async def convert(self, eur):
+        return await self._call('convertToBitcoin', pb2.Message(message=eur))
+
+    async def convert_many(self, amounts):
+        message = pb2.BatchMessage(messages=list(amounts))
+        response = await self._call('convertToBitcoinBatch', message)
+        return list(response.responses)
+
+    async def close(self):
+        await self.channel.close()
 
 
-class UnaryClient(object):
+class UnaryClient(ConverterClient):
     """
     Client for gRPC functionality
     """
@@ -12,20 +252,214 @@ class UnaryClient(object):
         self.host = 'localhost'
         self.server_port = 50051
 
-        # instantiate a channel
-        self.channel = grpc.insecure_channel(
+        # instantiate a channel and bind the client and the server
+        super(UnaryClient, self).__init__(
             '{}:{}'.format(self.host, self.server_port))
 
-        # bind the client and the server
-        self.stub = pb2_grpc.convertToCryptoStub(self.channel)
-
     def get_bitcoins(self, eur):
         """
         Client function to call the rpc for GetServerResponse
         """
-        message = pb2.Message(message=eur)
-        print(f'Sent request to convert {message} to bitcoins')
-        return self.stub.convertToBitcoin(message)
+        print(f'Sent request to convert {eur} to bitcoins')
+        return self.convert(eur)
+
+    def get_bitcoins_batch(self, amounts):
+        """
+        Convert several amounts with one convertToBitcoinBatch call
+        """
+        return self.convert_many(amounts)
+
+    def stream_bitcoins(self, amounts):
+        """
+        Convert an iterable of amounts over one bidirectional stream
+        """
+        return self.stream(amounts)
+
+
+class ConversionBatcher(object):
+    """
+    Coalesces concurrent conversions into convertToBitcoinBatch calls
+
+    The first queued amount opens a window of `window` seconds; every
+    amount queued during the window, up to `max_batch`, is sent with it.
+    Callers wait at most for the batch ahead of theirs and their own, each
+    bounded by the client's deadline.
+    """
+
+    def __init__(self, client, window=0.005, max_batch=500):
+        self.client = client
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def convert_many(self, amounts):
+        return self.client.convert_many(amounts)
+
+    def convert(self, eur, timeout=None):
+        if timeout is None:
+            timeout = 2 * self.client.timeout + self.window
+        future = futures.Future()
+        self._queue.put((eur, future))
+        self.start()
+        try:
+            return future.result(timeout)
+        except futures.TimeoutError:
+            raise ConversionFailed(
+                'No conversion of {} within {}s'.format(eur, timeout))
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                responses = list(self.convert_many(eur for eur, _ in batch))
+                if len(responses) != len(batch):
+                    raise ConversionFailed(
+                        'Converter answered {} of {} amounts'.format(
+                            len(responses), len(batch)))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), response in zip(batch, responses):
+                future.set_result(response)
+
+    def start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name='conversion-batcher',
+                        daemon=True)
+                    self._thread.start()
+
+
+class RateCache(object):
+    """
+    EUR to BTC exchange rate derived from converter responses
+
+    While the rate is younger than `ttl` seconds conversions are computed
+    locally; otherwise they go through the `converter`. A background thread
+    keeps the rate fresh every `refresh_interval` seconds by converting
+    `reference` EUR. Local results are scaled from that answer and rounded
+    to as many significant digits as the converter gave it, so they carry
+    no more precision than the converter's own.
+    """
+
+    def __init__(self, converter, ttl, refresh_interval, reference='1000.00'):
+        self.converter = converter
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.reference = reference
+        self._rate = None
+        self._updated = None
+        self._lock = threading.Lock()
+        self._thread = None
+        RATE_AGE.set_function(self.age)
+
+    def age(self):
+        if self._updated is None:
+            return float('inf')
+        return time.monotonic() - self._updated
+
+    def _remember(self, response):
+        try:
+            bitcoins = Decimal(response.message)
+        except InvalidOperation:
+            return
+        if not bitcoins.is_finite() or bitcoins <= 0:
+            return
+        with self._lock:
+            self._rate = (Decimal(self.reference), bitcoins)
+            self._updated = time.monotonic()
+
+    def _fresh_rate(self):
+        with self._lock:
+            if (self._updated is not None
+                    and time.monotonic() - self._updated < self.ttl):
+                return self._rate
+        return None
+
+    def _local(self, eur, rate):
+        reference, converted = rate
+        try:
+            digits = len(converted.as_tuple().digits)
+            bitcoins = Context(prec=digits).divide(
+                Decimal(eur) * converted, reference)
+        except InvalidOperation:
+            return None
+        RATE_CACHE_HITS.inc()
+        return pb2.MessageResponse(message=format(bitcoins, 'f'), received=True)
+
+    def refresh(self):
+        self._remember(self.converter.convert(self.reference))
+
+    def convert(self, eur):
+        """
+        Convert `eur` to bitcoins, returning the converter's response message
+        """
+        rate = self._fresh_rate()
+        if rate is not None:
+            response = self._local(eur, rate)
+            if response is not None:
+                return response
+        RATE_CACHE_MISSES.inc()
+        return self.converter.convert(eur)
+
+    def convert_many(self, amounts):
+        """
+        Convert several amounts, sending only the cache misses to the converter
+        """
+        responses = [None] * len(amounts)
+        rate = self._fresh_rate()
+        if rate is not None:
+            for i, eur in enumerate(amounts):
+                responses[i] = self._local(eur, rate)
+        misses = [i for i, response in enumerate(responses) if response is None]
+        RATE_CACHE_MISSES.inc(len(misses))
+        converted = self.converter.convert_many([amounts[i] for i in misses])
+        for i, response in zip(misses, converted):
+            responses[i] = response
+        return responses
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                # An open circuit or a bad response must not end the thread;
+                # the next attempt may succeed
+                log.warning(
+                    'Osvezevanje tecaja ni uspelo: %s', e,
+                    extra={
+                        'name_of_service': 'Placila',
+                        'crud_method': None,
+                        'directions': 'out',
+                        'ip_node': None,
+                        'status': 'fail',
+                        'http_code': None,
+                    })
+            time.sleep(self.refresh_interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='rate-cache', daemon=True)
+            self._thread.start()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,115 @@
+import threading
+import time
+import unittest
+
+import grpc
+import unary_pb2 as pb2
+from grpc_client import (ConversionBatcher, ConversionFailed, ConverterClient,
+                         RateCache)
+from grpc_test_server import serve
+from resilience import CircuitOpen
+
+
+class TestConversion(unittest.TestCase):
+
+    def setUp(self):
+        self.server, self.servicer, port = serve()
+        self.client = ConverterClient('127.0.0.1:{}'.format(port))
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop(None)
+
+    def test_batcher_coalesces_concurrent_conversions(self):
+        batcher = ConversionBatcher(self.client, window=0.2, max_batch=100)
+        results = {}
+
+        def convert(eur):
+            results[eur] = batcher.convert(eur, timeout=5)
+
+        threads = [threading.Thread(target=convert, args=(str(i),))
+                   for i in range(1, 21)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(results), 20)
+        self.assertEqual(results['10'].message,
+                         self.servicer.convert('10').message)
+        self.assertLess(self.servicer.calls['convertToBitcoinBatch'], 20)
+
+    def test_batcher_fails_amounts_without_a_response(self):
+        class Client(object):
+            timeout = 0.1
+
+            def convert_many(self, amounts):
+                return list(amounts)[1:]
+
+        batcher = ConversionBatcher(Client(), window=0)
+        with self.assertRaises(ConversionFailed):
+            batcher.convert('10.00', timeout=5)
+
+    def test_rate_cache_converts_locally_once_rate_is_known(self):
+        cache = RateCache(ConversionBatcher(self.client, window=0),
+                          ttl=60, refresh_interval=60)
+        cache.refresh()
+        calls = self.servicer.calls['convertToBitcoinBatch']
+        responses = cache.convert_many(['10.00', '20.00'])
+        self.assertEqual([r.received for r in responses], [True, True])
+        self.assertEqual(self.servicer.calls['convertToBitcoinBatch'], calls)
+
+    def test_rate_cache_keeps_converter_precision(self):
+        class Converter(object):
+            # Formats like a converter returning str(float)
+            def convert(self, eur):
+                return pb2.MessageResponse(
+                    message=str(float(eur) * 0.0000234), received=True)
+
+        cache = RateCache(Converter(), ttl=60, refresh_interval=60)
+        cache.convert('3.00')
+        self.assertIsNone(cache._fresh_rate())
+        cache.refresh()
+        self.assertEqual(cache.convert('1.00').message, '0.0000234')
+        self.assertEqual(cache.convert('10.00').message, '0.000234')
+        self.assertEqual(cache.convert('0.01').message, '0.000000234')
+
+    def test_rate_cache_falls_back_to_rpc_when_expired(self):
+        cache = RateCache(ConversionBatcher(self.client, window=0),
+                          ttl=0, refresh_interval=60)
+        cache.convert('10.00')
+        self.assertEqual(self.servicer.calls['convertToBitcoinBatch'], 1)
+
+    def test_rate_cache_refresh_survives_open_circuit(self):
+        class Down(object):
+            def convert(self, eur):
+                raise CircuitOpen('pretvornik')
+
+        cache = RateCache(Down(), ttl=60, refresh_interval=0.01)
+        with self.assertLogs('Placila', 'WARNING'):
+            cache.start()
+            time.sleep(0.05)
+        self.assertTrue(cache._thread.is_alive())
+
+    def test_stream_answers_every_amount(self):
+        responses = list(self.client.stream(['1', '2', '3']))
+        self.assertEqual(len(responses), 3)
+
+    def test_stream_settles_half_open_breaker(self):
+        breaker = self.client.breaker
+        breaker.failure_threshold = 1
+        breaker.reset_timeout = 0
+        breaker.failure()
+        self.assertEqual(len(list(self.client.stream(['1', '2']))), 2)
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.client.convert('10.00')
+
+    def test_breaker_opens_when_converter_is_down(self):
+        self.server.stop(None)
+        for _ in range(self.client.breaker.failure_threshold):
+            with self.assertRaises(grpc.RpcError):
+                self.client.convert('10.00')
+        with self.assertRaises(CircuitOpen):
+            self.client.convert('10.00')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+from concurrent import futures
+from decimal import Decimal, InvalidOperation
+
+import grpc
+import unary_pb2_grpc as pb2_grpc
+import unary_pb2 as pb2
+
+
+class ConvertToCryptoServicer(pb2_grpc.convertToCryptoServicer):
+    """
+    In-process stand-in for the convertToCrypto service with a fixed rate
+    """
+
+    def __init__(self, rate='0.0000234'):
+        self.rate = Decimal(rate)
+        self.calls = {'convertToBitcoin': 0, 'convertToBitcoinBatch': 0,
+                      'convertToBitcoinStream': 0}
+
+    def convert(self, eur):
+        try:
+            bitcoins = Decimal(eur) * self.rate
+        except InvalidOperation:
+            return pb2.MessageResponse(message='', received=False)
+        return pb2.MessageResponse(message=format(bitcoins, 'f'), received=True)
+
+    def convertToBitcoin(self, request, context):
+        self.calls['convertToBitcoin'] += 1
+        response = self.convert(request.message)
+        if not response.received:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                          'Invalid amount {}'.format(request.message))
+        return response
+
+    def convertToBitcoinBatch(self, request, context):
+        self.calls['convertToBitcoinBatch'] += 1
+        return pb2.BatchMessageResponse(
+            responses=[self.convert(eur) for eur in request.messages])
+
+    def convertToBitcoinStream(self, request_iterator, context):
+        self.calls['convertToBitcoinStream'] += 1
+        for request in request_iterator:
+            yield self.convert(request.message)
+
+
+def serve(port=0, servicer=None):
+    """
+    Start the stand-in server, returning the server, servicer and bound port
+    """
+    servicer = servicer or ConvertToCryptoServicer()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    pb2_grpc.add_convertToCryptoServicer_to_server(servicer, server)
+    port = server.add_insecure_port('127.0.0.1:{}'.format(port))
+    server.start()
+    return server, servicer, port
+
+
+if __name__ == '__main__':
+    server, servicer, port = serve(50051)
+    print(f'Stand-in convertToCrypto server listening on port {port}')
+    server.wait_for_termination()
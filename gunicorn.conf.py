@@ -0,0 +1,45 @@
+import os
+
+bind = "0.0.0.0:5002"
+worker_class = "gthread"
+# One worker by default. Every worker keeps its own Prometheus registry, so
+# with several of them /metrics reports whichever worker answered the scrape.
+# Each worker also opens up to DB_POOL_MAX connections to the primary and to
+# every replica, plus one LISTEN connection for the change feed: keep
+# workers * (DB_POOL_MAX + 1) below PostgreSQL's max_connections (100 by
+# default), leaving room for other clients. Scale out with more instances,
+# or with more GUNICORN_THREADS and a DB_POOL_MAX to match.
+workers = int(os.environ.get("GUNICORN_WORKERS", 1))
+# Each /placila/dogodki stream occupies a thread for as long as its client
+# stays connected, so a worker accepts at most threads // 2 streams (and never
+# more than CHANGEFEED_MAX_SUBSCRIBERS); the rest answer 503. To serve N
+# concurrent streams per instance, size workers * threads to at least 2 * N.
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 0))
+accesslog = None
+errorlog = "-"
+
+# The application is imported once in the master and shared by the workers.
+# create_app opens no sockets and starts no threads; each worker creates its
+# own database pool, gRPC channel and Fluentd sender in post_fork.
+preload_app = True
+
+
+def post_fork(server, worker):
+    import api
+    import wsgi
+
+    wsgi.app.config["WORKER_THREADS"] = worker.cfg.threads
+    api.ensure_services(wsgi.app)
+
+
+def worker_exit(server, worker):
+    # Runs in the worker once it stops accepting requests: flush buffered
+    # log records and close the pool and channels.
+    import api
+
+    api.shutdown_services()
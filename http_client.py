@@ -0,0 +1,100 @@
+import time
+
+import requests
+from prometheus_client import Counter, Histogram
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from resilience import CircuitBreaker
+
+HTTP_LATENCY = Histogram(
+    "placila_http_latency_seconds",
+    "Latency of calls to other services",
+    ["service", "method"],
+)
+HTTP_ERRORS = Counter(
+    "placila_http_errors_total",
+    "Failed calls to other services",
+    ["service", "method", "reason"],
+)
+
+
+class ServiceClient(object):
+    """
+    Pooled HTTP client for another microservice
+
+    Connections are kept alive in a pool of `pool_size` per host. Every
+    call is bounded by `connect_timeout` and `read_timeout`; connection
+    errors and 502/503/504 answers are retried up to `max_retries` times
+    with exponential backoff, and a circuit breaker stops calling the
+    service while it keeps failing.
+    """
+
+    RETRY_STATUS = (502, 503, 504)
+
+    def __init__(
+        self,
+        name,
+        base_url,
+        connect_timeout=1.0,
+        read_timeout=3.0,
+        max_retries=2,
+        backoff=0.1,
+        pool_size=10,
+        breaker=None,
+    ):
+        self.name = name
+        self.base_url = base_url.rstrip("/") + "/"
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker or CircuitBreaker(name)
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff,
+            status_forcelist=self.RETRY_STATUS,
+            allowed_methods=frozenset(["GET", "DELETE"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, path, **kwargs):
+        self.breaker.before_call()
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.monotonic()
+        try:
+            resp = self.session.request(method, self.base_url + path, **kwargs)
+        except requests.RequestException as e:
+            HTTP_ERRORS.labels(self.name, method, type(e).__name__).inc()
+            self.breaker.failure()
+            raise
+        finally:
+            HTTP_LATENCY.labels(self.name, method).observe(time.monotonic() - start)
+        if resp.status_code >= 500:
+            HTTP_ERRORS.labels(self.name, method, str(resp.status_code)).inc()
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        return resp
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def ping(self, timeout=None):
+        """
+        Whether the service answers without a server error
+
+        Health probes bypass the circuit breaker so that they keep
+        reporting the real state of the service while the circuit is open.
+        """
+        resp = self.session.get(self.base_url, timeout=timeout or self.timeout)
+        return resp.status_code < 500
+
+    def close(self):
+        self.session.close()
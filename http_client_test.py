@@ -0,0 +1,54 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from http_client import ServiceClient
+from resilience import CircuitOpen
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    delay = 0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+class TestServiceClient(unittest.TestCase):
+    def setUp(self):
+        SlowHandler.delay = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}/".format(self.server.server_port)
+        self.client = ServiceClient("test", url, read_timeout=0.2, max_retries=0)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_reuses_pooled_connection(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get("x").status_code, 200)
+        pool = self.client.session.get_adapter("http://").poolmanager.pools
+        self.assertEqual(len(pool.keys()), 1)
+
+    def test_breaker_opens_after_timeouts(self):
+        SlowHandler.delay = 0.5
+        for _ in range(self.client.breaker.failure_threshold):
+            with self.assertRaises(requests.RequestException):
+                self.client.get("x")
+        with self.assertRaises(CircuitOpen):
+            self.client.get("x")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import logging
+import threading
+
+from prometheus_client import Counter
+
+IDEMPOTENCY_REQUESTS = Counter(
+    "placila_idempotency_requests_total",
+    "Requests carrying an Idempotency-Key, by how they were answered",
+    ["result"],
+)
+
+log = logging.getLogger("Placila")
+
+
+class IdempotencyConflict(Exception):
+    """
+    The key was already used for a request with a different body
+    """
+
+    def __init__(self, key):
+        super(IdempotencyConflict, self).__init__(
+            "Idempotency key {} was used for a different request".format(key)
+        )
+        self.key = key
+
+
+def fingerprint(args):
+    """
+    Hash of the parsed request arguments, independent of their order
+    """
+    return hashlib.sha256(
+        json.dumps(args, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class IdempotencyStore(object):
+    """
+    Stored responses of requests sent with an Idempotency-Key
+
+    A response is written to the idempotency_keys table in the same
+    transaction as the change it reports, through claim() and save(), and
+    kept for `ttl` seconds. Recent responses are also held in `cache`, so
+    most replays are answered without a query. A background thread deletes
+    expired keys every `cleanup_interval` seconds.
+    """
+
+    def __init__(self, pool, cache, ttl=86400, cleanup_interval=300):
+        self.pool = pool
+        self.cache = cache
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="idempotency-cleanup", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped.wait(self.cleanup_interval):
+            try:
+                self.cleanup()
+            except Exception:
+                log.exception(
+                    "Brisanje zastarelih Idempotency-Key ni uspelo",
+                    extra={
+                        "name_of_service": "Placila",
+                        "crud_method": None,
+                        "directions": None,
+                        "ip_node": None,
+                        "status": "fail",
+                        "http_code": None,
+                    },
+                )
+
+    def _check(self, key, stored, digest):
+        if stored[0] != digest:
+            IDEMPOTENCY_REQUESTS.labels("conflict").inc()
+            raise IdempotencyConflict(key)
+        return stored[1], stored[2]
+
+    def lookup(self, cur, key, digest):
+        """
+        Return the stored (status, body) for the key, or None
+
+        Raises IdempotencyConflict if the key belongs to another request.
+        """
+        stored = self.cache.get(key)
+        if stored is not None:
+            response = self._check(key, stored, digest)
+            IDEMPOTENCY_REQUESTS.labels("cache").inc()
+            return response
+        cur.execute(
+            """SELECT fingerprint, status, response,
+                   EXTRACT(EPOCH FROM created_at - now())::float8 + %s
+               FROM idempotency_keys
+               WHERE key = %s AND status IS NOT NULL
+               AND created_at > now() - %s * interval '1 second'""",
+            (self.ttl, key, self.ttl),
+        )
+        row = cur.fetchone()
+        if row is None:
+            return None
+        # Cached no longer than the stored response lives
+        stored, expires_in = row[:3], row[3]
+        self.cache.set(key, stored, ttl=expires_in)
+        response = self._check(key, stored, digest)
+        IDEMPOTENCY_REQUESTS.labels("database").inc()
+        return response
+
+    def claim(self, cur, key, digest):
+        """
+        Reserve the key in the caller's transaction
+
+        Returns False if another request already holds it. A concurrent
+        request with the same key waits here until the first one commits
+        or rolls back.
+        """
+        cur.execute(
+            """INSERT INTO idempotency_keys (key, fingerprint) VALUES (%s, %s)
+               ON CONFLICT (key) DO UPDATE
+               SET fingerprint = EXCLUDED.fingerprint, status = NULL,
+                   response = NULL, created_at = now()
+               WHERE idempotency_keys.created_at
+                   <= now() - %s * interval '1 second'
+               RETURNING key""",
+            (key, digest, self.ttl),
+        )
+        return cur.fetchone() is not None
+
+    def save(self, cur, key, digest, status, body):
+        """
+        Store the response of a claimed key
+
+        Returns the cache entry and the seconds left until the key expires;
+        cache it for that long after the commit.
+        """
+        cur.execute(
+            """UPDATE idempotency_keys SET status = %s, response = %s
+               WHERE key = %s
+               RETURNING EXTRACT(EPOCH FROM created_at - now())::float8 + %s""",
+            (status, json.dumps(body), key, self.ttl),
+        )
+        expires_in = cur.fetchone()[0]
+        IDEMPOTENCY_REQUESTS.labels("stored").inc()
+        return (digest, status, body), expires_in
+
+    def cleanup(self):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """DELETE FROM idempotency_keys
+                       WHERE created_at <= now() - %s * interval '1 second'""",
+                    (self.ttl,),
+                )
+            conn.commit()
@@ -0,0 +1,146 @@
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import flask_restx
+from flask import g, has_request_context, request
+from prometheus_client import Counter, Gauge, Histogram
+
+STAGE_LATENCY = Histogram(
+    "placila_stage_seconds",
+    "Time spent in each stage of a request",
+    ["handler", "stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+STARTUP_PHASE = Gauge(
+    "placila_startup_phase_seconds",
+    "Time the last start of this process spent in each phase",
+    ["phase"],
+)
+PROFILED_REQUESTS = Counter(
+    "placila_profiled_requests_total", "Requests recorded by the sampling profiler"
+)
+
+
+def current_handler():
+    """
+    Label for the running request, e.g. "PUT /placila/<int:id>"
+    """
+    if has_request_context() and request.url_rule is not None:
+        return "%s %s" % (request.method, request.url_rule.rule)
+    return "background"
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(current_handler(), name).observe(
+            time.perf_counter() - start
+        )
+
+
+@contextmanager
+def startup_phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_PHASE.labels(name).set(time.perf_counter() - start)
+
+
+def marshal(*args, **kwargs):
+    with stage("marshal"):
+        return flask_restx.marshal(*args, **kwargs)
+
+
+def marshal_with(fields, *args, **kwargs):
+    """
+    flask_restx.marshal_with that records the marshalling as its own stage
+    """
+    marshaller = flask_restx.marshal_with(fields, *args, **kwargs)
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*a, **kw):
+            resp = f(*a, **kw)
+            with stage("marshal"):
+                return marshaller(lambda: resp)()
+
+        return wrapper
+
+    return decorator
+
+
+class StageLoggerAdapter(logging.LoggerAdapter):
+    """
+    Logger that records the time spent logging as the "log" stage
+
+    Unlike the stock adapter it passes the caller's `extra` through.
+    """
+
+    def __init__(self, logger):
+        super(StageLoggerAdapter, self).__init__(logger, {})
+
+    def process(self, msg, kwargs):
+        return msg, kwargs
+
+    def log(self, level, msg, *args, **kwargs):
+        with stage("log"):
+            super(StageLoggerAdapter, self).log(level, msg, *args, **kwargs)
+
+
+class RequestProfiler(object):
+    """
+    Profiles a random `sample_rate` share of requests with cProfile
+
+    Each sampled request is written to `directory` as a .prof file that
+    can be read with pstats or snakeviz. The rate can be changed while
+    the application runs.
+    """
+
+    def __init__(self, directory, sample_rate=0.0):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+
+    def configure(self, sample_rate=None, directory=None):
+        with self._lock:
+            if sample_rate is not None:
+                self.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+            if directory is not None:
+                self.directory = directory
+
+    def start(self):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active in this thread
+            return
+        g._profile = profile
+
+    def stop(self, response):
+        profile = g.pop("_profile", None)
+        if profile is None:
+            return response
+        profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        name = "%s-%d-%d-%s.prof" % (
+            request.method,
+            int(time.time() * 1000),
+            os.getpid(),
+            (request.endpoint or "unknown").replace("/", "_"),
+        )
+        profile.dump_stats(os.path.join(self.directory, name))
+        PROFILED_REQUESTS.inc()
+        return response
@@ -0,0 +1,117 @@
+import logging
+import queue
+import threading
+import time
+
+import msgpack
+from fluent import sender
+from prometheus_client import Counter, Gauge
+
+LOG_QUEUE_DEPTH = Gauge(
+    "placila_log_queue_depth", "Log records waiting to be sent to Fluentd"
+)
+LOG_DROPPED = Counter(
+    "placila_log_dropped_total", "Log records dropped because the queue was full"
+)
+LOG_BATCHES = Counter("placila_log_batches_total", "Batches of log records sent")
+LOG_SEND_FAILED = Counter(
+    "placila_log_send_failed_total", "Batches of log records Fluentd did not accept"
+)
+
+# Failures to reach Fluentd go to the root logger's stderr handler; logging
+# them through the handler itself would only queue more records for it
+log = logging.getLogger(__name__)
+
+
+class BatchingFluentHandler(logging.Handler):
+    """
+    Logging handler that sends records to Fluentd from a background thread
+
+    Records are formatted in the caller's thread and put on a queue of at
+    most `maxsize` records. When the queue is full they are dropped
+    (`policy="drop"`) or the caller waits up to `block_timeout` seconds for
+    room (`policy="block"`). The sender thread ships up to `batch_size`
+    records at once, at least every `flush_interval` seconds, as a single
+    Fluentd forward-mode message.
+    """
+
+    def __init__(
+        self,
+        tag,
+        host="localhost",
+        port=24224,
+        maxsize=10000,
+        batch_size=100,
+        flush_interval=0.5,
+        policy="drop",
+        block_timeout=0.05,
+    ):
+        super(BatchingFluentHandler, self).__init__()
+        self.tag = tag
+        self.sender = sender.FluentSender(tag, host=host, port=port)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.queue = queue.Queue(maxsize)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="fluent-sender", daemon=True
+        )
+        self._thread.start()
+        LOG_QUEUE_DEPTH.set_function(self.queue.qsize)
+
+    def emit(self, record):
+        try:
+            entry = [int(record.created), self.format(record)]
+        except Exception:
+            self.handleError(record)
+            return
+        try:
+            if self.policy == "block":
+                self.queue.put(entry, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(entry)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+    def _collect(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if self._closed.is_set() or remaining <= 0:
+                    batch.append(self.queue.get_nowait())
+                else:
+                    batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _send(self, batch):
+        # FluentSender only exposes per-event emit, so the forward-mode
+        # packet is packed here and written through its connection handling.
+        self.sender._send(msgpack.packb([self.tag, batch]))
+        LOG_BATCHES.inc()
+
+    def _run(self):
+        while not (self._closed.is_set() and self.queue.empty()):
+            batch = self._collect()
+            if batch:
+                try:
+                    self._send(batch)
+                except Exception as e:
+                    LOG_SEND_FAILED.inc()
+                    log.warning(
+                        "Sending %s log records to Fluentd failed: %s", len(batch), e
+                    )
+
+    def close(self):
+        self._closed.set()
+        self._thread.join(timeout=5)
+        self.sender.close()
+        super(BatchingFluentHandler, self).close()
@@ -0,0 +1,198 @@
+import json
+import logging
+import threading
+import time
+
+from prometheus_client import Counter, Gauge
+
+from database import ensure_schema
+
+OUTBOX_PENDING = Gauge(
+    "placila_outbox_pending", "Outbox events waiting to be delivered"
+)
+OUTBOX_LAG = Gauge(
+    "placila_outbox_lag_seconds", "Age of the oldest undelivered outbox event"
+)
+OUTBOX_DELIVERED = Counter(
+    "placila_outbox_delivered_total", "Delivered outbox events", ["kind"]
+)
+OUTBOX_FAILED = Counter(
+    "placila_outbox_failed_total", "Failed outbox delivery attempts", ["kind"]
+)
+OUTBOX_ERRORS = Counter(
+    "placila_outbox_errors_total",
+    "Dispatcher rounds that failed before the events could be delivered",
+)
+
+log = logging.getLogger("Placila")
+
+
+def enqueue(cur, kind, key, payload):
+    """
+    Record an event in the caller's transaction
+
+    While an event with the same kind and key is still pending, enqueueing
+    it again does nothing.
+    """
+    cur.execute(
+        """INSERT INTO outbox (kind, key, payload) VALUES (%s, %s, %s)
+           ON CONFLICT (kind, key) WHERE sent_at IS NULL DO NOTHING""",
+        (kind, str(key), json.dumps(payload)),
+    )
+
+
+class OutboxDispatcher(object):
+    """
+    Background thread that delivers events written to the outbox table
+
+    Every `interval` seconds, or as soon as wake() is called, up to
+    `batch_size` due events are claimed with FOR UPDATE SKIP LOCKED, so
+    several workers can dispatch side by side. Claiming moves an event's
+    next attempt `claim_timeout` seconds ahead and commits, and the events
+    are then passed to the handler registered for their kind without a
+    transaction or connection held open. Handlers must be idempotent since
+    an event is delivered again once its claim expires if the worker dies
+    before marking it sent. Failed events are retried with exponential
+    backoff capped at `max_backoff` seconds. Delivered events are kept for
+    `retention` seconds and removed every `cleanup_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        pool,
+        handlers,
+        batch_size=100,
+        interval=1.0,
+        max_backoff=300,
+        retention=86400,
+        claim_timeout=300,
+        cleanup_interval=300,
+    ):
+        self.pool = pool
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.retention = retention
+        self.claim_timeout = claim_timeout
+        self.cleanup_interval = cleanup_interval
+        self._cleaned_at = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="outbox-dispatcher", daemon=True
+        )
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=5):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                ensure_schema(self.pool)
+                while self.dispatch() == self.batch_size:
+                    if self._stopped.is_set():
+                        return
+                now = time.monotonic()
+                if (
+                    self._cleaned_at is None
+                    or now - self._cleaned_at >= self.cleanup_interval
+                ):
+                    self.cleanup()
+                    self._cleaned_at = now
+            except Exception:
+                OUTBOX_ERRORS.inc()
+                log.exception(
+                    "Posiljanje dogodkov iz outboxa ni uspelo",
+                    extra={
+                        "name_of_service": "Placila",
+                        "crud_method": None,
+                        "directions": "out",
+                        "ip_node": None,
+                        "status": "fail",
+                        "http_code": None,
+                    },
+                )
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _deliver(self, kind, payload):
+        handler = self.handlers.get(kind)
+        if handler is None:
+            raise LookupError("No handler for outbox event {}".format(kind))
+        handler(payload)
+
+    def dispatch(self):
+        """
+        Deliver one batch of due events and return how many were claimed
+        """
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """UPDATE outbox
+                       SET next_attempt_at = now() + %s * interval '1 second'
+                       WHERE id IN (
+                           SELECT id FROM outbox
+                           WHERE sent_at IS NULL AND next_attempt_at <= now()
+                           ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED)
+                       RETURNING id, kind, payload""",
+                    (self.claim_timeout, self.batch_size),
+                )
+                events = sorted(cur.fetchall())
+            conn.commit()
+
+        sent, failed = [], []
+        for event_id, kind, payload in events:
+            try:
+                self._deliver(kind, payload)
+            except Exception as e:
+                OUTBOX_FAILED.labels(kind).inc()
+                failed.append((event_id, str(e)[:500]))
+            else:
+                OUTBOX_DELIVERED.labels(kind).inc()
+                sent.append(event_id)
+
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                if sent:
+                    cur.execute(
+                        "UPDATE outbox SET sent_at = now() WHERE id = ANY(%s)",
+                        (sent,),
+                    )
+                for event_id, error in failed:
+                    cur.execute(
+                        """UPDATE outbox SET attempts = attempts + 1,
+                               last_error = %s,
+                               next_attempt_at = now() + LEAST(
+                                   power(2, attempts), %s) * interval '1 second'
+                           WHERE id = %s""",
+                        (error, self.max_backoff, event_id),
+                    )
+                cur.execute("""SELECT count(*),
+                           COALESCE(EXTRACT(EPOCH FROM now() - min(created_at)), 0)
+                       FROM outbox WHERE sent_at IS NULL""")
+                pending, lag = cur.fetchone()
+            conn.commit()
+        OUTBOX_PENDING.set(pending)
+        OUTBOX_LAG.set(float(lag))
+        return len(events)
+
+    def cleanup(self):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """DELETE FROM outbox WHERE sent_at IS NOT NULL
+                       AND sent_at < now() - %s * interval '1 second'""",
+                    (self.retention,),
+                )
+            conn.commit()
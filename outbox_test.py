@@ -0,0 +1,122 @@
+import json
+import os
+import unittest
+
+import psycopg2
+
+from database import ConnectionPool, migrate
+from outbox import OutboxDispatcher, enqueue
+
+SCHEMA = "outbox_test"
+
+
+def connect_kwargs():
+    with open(os.path.join(os.path.dirname(__file__), "config.json")) as f:
+        config = json.load(f)
+    for item in config:
+        if os.environ.get(item):
+            config[item] = os.environ[item]
+    return dict(
+        database=config["PGDATABASE"],
+        user=config["PGUSER"],
+        password=config["PGPASSWORD"],
+        port=config["DATABASE_PORT"],
+        host=config["DATABASE_IP"],
+    )
+
+
+class TestOutboxDispatcher(unittest.TestCase):
+    """
+    Runs against PostgreSQL, in a schema of its own
+    """
+
+    def setUp(self):
+        try:
+            conn = psycopg2.connect(**connect_kwargs())
+        except psycopg2.OperationalError as e:
+            self.skipTest("PostgreSQL ni dosegljiv: %s" % e)
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA IF EXISTS {0} CASCADE".format(SCHEMA))
+            cur.execute("CREATE SCHEMA {0}".format(SCHEMA))
+        conn.commit()
+        conn.close()
+        self.pool = ConnectionPool(
+            1,
+            4,
+            5,
+            0,
+            name=SCHEMA,
+            options="-c search_path={0}".format(SCHEMA),
+            **connect_kwargs()
+        )
+        with self.pool.connection() as conn:
+            migrate(conn)
+        self.delivered = []
+
+    def tearDown(self):
+        self.pool.closeall()
+        conn = psycopg2.connect(**connect_kwargs())
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA {0} CASCADE".format(SCHEMA))
+        conn.commit()
+        conn.close()
+
+    def enqueue(self, *keys):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                for key in keys:
+                    enqueue(cur, "test", key, {"id": key})
+            conn.commit()
+
+    def query(self, sql):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql)
+                rows = cur.fetchall()
+            conn.commit()
+        return rows
+
+    def dispatcher(self, handler):
+        return OutboxDispatcher(self.pool, {"test": handler})
+
+    def test_delivers_and_marks_events_sent(self):
+        self.enqueue(1, 2)
+        self.assertEqual(self.dispatcher(self.delivered.append).dispatch(), 2)
+        self.assertEqual(self.delivered, [{"id": 1}, {"id": 2}])
+        self.assertEqual(
+            self.query("SELECT count(*) FROM outbox WHERE sent_at IS NULL"), [(0,)]
+        )
+
+    def test_claimed_events_are_not_dispatched_twice(self):
+        self.enqueue(1)
+        other = self.dispatcher(self.delivered.append)
+
+        def handler(payload):
+            self.assertEqual(other.dispatch(), 0)
+            self.delivered.append(payload)
+
+        self.assertEqual(self.dispatcher(handler).dispatch(), 1)
+        self.assertEqual(self.delivered, [{"id": 1}])
+
+    def test_failed_events_back_off(self):
+        self.enqueue(1)
+
+        def handler(payload):
+            raise RuntimeError("prevozi ne odgovarjajo")
+
+        dispatcher = self.dispatcher(handler)
+        self.assertEqual(dispatcher.dispatch(), 1)
+        self.assertEqual(dispatcher.dispatch(), 0)
+        ((attempts, error, delay),) = self.query("""SELECT attempts, last_error,
+                   EXTRACT(EPOCH FROM next_attempt_at - now())
+               FROM outbox""")
+        self.assertEqual((attempts, error), (1, "prevozi ne odgovarjajo"))
+        self.assertTrue(0 < delay <= 1)
+        self.query("UPDATE outbox SET next_attempt_at = now() RETURNING id")
+        dispatcher.handlers["test"] = self.delivered.append
+        self.assertEqual(dispatcher.dispatch(), 1)
+        self.assertEqual(self.delivered, [{"id": 1}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import socket
+import threading
+import time
+
+from prometheus_client import Gauge, Histogram
+
+DEPENDENCY_UP = Gauge(
+    "placila_dependency_up",
+    "Whether the last health probe of a dependency passed",
+    ["dependency"],
+)
+PROBE_LATENCY = Histogram(
+    "placila_health_probe_seconds", "Duration of health probes", ["dependency"]
+)
+
+
+class HealthProber(object):
+    """
+    Runs health checks on a background thread and caches their results
+
+    Every `interval` seconds each registered check is called; it returns
+    (passed, output) or raises. Requests read the cached results, so
+    probing the service never touches its dependencies. Results older
+    than three intervals count as failed, in case the prober stalls.
+    Readiness only depends on the checks registered as critical.
+    """
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.hostname = socket.gethostname()
+        self._checks = []
+        self._results = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add_check(self, name, check, critical=True):
+        self._checks.append((name, check, critical))
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="health-prober", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(self.interval)
+
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.probe()
+            self._stopped.wait(self.interval)
+
+    def probe(self):
+        for name, check, critical in self._checks:
+            start = time.monotonic()
+            try:
+                passed, output = check()
+            except Exception as e:
+                passed, output = False, "%s: %s" % (type(e).__name__, e)
+            duration = time.monotonic() - start
+            PROBE_LATENCY.labels(name).observe(duration)
+            DEPENDENCY_UP.labels(name).set(1 if passed else 0)
+            with self._lock:
+                self._results[name] = {
+                    "checker": name,
+                    "output": output,
+                    "passed": bool(passed),
+                    "critical": critical,
+                    "timestamp": time.time(),
+                    "response_time": duration,
+                }
+
+    def results(self):
+        stale = time.time() - 3 * self.interval
+        with self._lock:
+            results = [dict(r) for r in self._results.values()]
+        for name, _, critical in self._checks:
+            if name not in self._results:
+                results.append(
+                    {
+                        "checker": name,
+                        "output": "Se ni preverjeno",
+                        "passed": False,
+                        "critical": critical,
+                        "timestamp": None,
+                    }
+                )
+        for r in results:
+            if r["timestamp"] is not None and r["timestamp"] < stale:
+                r["passed"] = False
+                r["output"] = "Zastarelo: %s" % r["output"]
+        return results
+
+    def healthy(self):
+        """
+        Cached status of every check, in the format py-healthcheck used
+
+        Every check is reported, but only failing critical checks make the
+        service unhealthy.
+        """
+        results = self.results()
+        passed = all(r["passed"] for r in results if r["critical"])
+        body = {
+            "hostname": self.hostname,
+            "status": "success" if passed else "failure",
+            "timestamp": time.time(),
+            "results": results,
+        }
+        return body, 200 if passed else 500
+
+    def ready(self):
+        results = [r for r in self.results() if r["critical"]]
+        passed = all(r["passed"] for r in results)
+        body = {"status": "ready" if passed else "not ready", "results": results}
+        return body, 200 if passed else 503
+
+    def live(self):
+        if not self.alive():
+            return {"status": "health prober stopped"}, 500
+        return {"status": "alive"}, 200
@@ -0,0 +1,36 @@
+import unittest
+
+from probes import HealthProber
+
+
+class TestHealthProber(unittest.TestCase):
+    def setUp(self):
+        self.prober = HealthProber(interval=60)
+        self.prober.add_check("baza", lambda: (True, "OK"))
+        self.prober.add_check("storitev", lambda: (False, "Napaka"), critical=False)
+
+    def test_not_ready_before_first_probe(self):
+        self.assertEqual(self.prober.ready()[1], 503)
+
+    def test_only_critical_checks_gate_readiness(self):
+        self.prober.probe()
+        body, code = self.prober.healthy()
+        self.assertEqual(code, 200)
+        self.assertIn(False, [r["passed"] for r in body["results"]])
+        self.assertEqual(self.prober.ready()[1], 200)
+
+    def test_failing_check_raising_is_reported(self):
+        self.prober.add_check("zlomljen", lambda: 1 / 0)
+        self.prober.probe()
+        body, code = self.prober.ready()
+        self.assertEqual(code, 503)
+        self.assertIn("ZeroDivisionError", body["results"][-1]["output"])
+
+    def test_stale_results_fail(self):
+        self.prober.probe()
+        self.prober.interval = -1
+        self.assertEqual(self.prober.ready()[1], 503)
+
+
+if __name__ == "__main__":
+    unittest.main()
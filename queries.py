@@ -0,0 +1,116 @@
+COLUMNS = ("id", "id_placnika", "id_prejemnika", "znesek_eur", "znesek_coin", "status")
+UPDATABLE = ("id_placnika", "id_prejemnika", "znesek_eur", "znesek_coin", "status")
+
+SELECT_COLUMNS = ", ".join(COLUMNS)
+
+# Statements on the placila table, prepared once per pooled connection by
+# database.PreparedConnection. Values are always bound parameters and column
+# names never come from the request.
+STATEMENTS = {
+    "placilo_po_id": "SELECT {} FROM placila WHERE id = $1".format(SELECT_COLUMNS),
+    # xmin changes whenever the row is written, so it serves as its version
+    "placilo_z_verzijo": "SELECT {}, xmin::text FROM placila WHERE id = $1".format(
+        SELECT_COLUMNS
+    ),
+    "dodaj_placilo": """INSERT INTO placila ({})
+        VALUES ($1, $2, $3, $4, $5, $6)""".format(
+        SELECT_COLUMNS
+    ),
+    "izbrisi_placilo": "DELETE FROM placila WHERE id = $1 RETURNING id",
+}
+for _column in UPDATABLE:
+    STATEMENTS["posodobi_" + _column] = """UPDATE placila SET {0} = $1
+        WHERE id = $2 RETURNING {1}""".format(_column, SELECT_COLUMNS)
+
+
+class NotUpdatable(ValueError):
+    def __init__(self, column):
+        super(NotUpdatable, self).__init__(
+            "Column {} can not be updated".format(column)
+        )
+        self.column = column
+
+
+def execute(cur, name, *params):
+    cur.connection.execute_prepared(cur, name, STATEMENTS[name], params)
+
+
+def get_placilo(cur, id):
+    """
+    Return the row of a placilo, or None
+    """
+    execute(cur, "placilo_po_id", id)
+    return cur.fetchone()
+
+
+def get_placilo_version(cur, id):
+    """
+    Return the row of a placilo and its version, or None
+    """
+    execute(cur, "placilo_z_verzijo", id)
+    row = cur.fetchone()
+    return None if row is None else (row[:-1], row[-1])
+
+
+def insert_placilo(
+    cur, id, id_placnika, id_prejemnika, znesek_eur, znesek_coin, status
+):
+    execute(
+        cur,
+        "dodaj_placilo",
+        id,
+        id_placnika,
+        id_prejemnika,
+        znesek_eur,
+        znesek_coin,
+        status,
+    )
+
+
+def update_placilo(cur, id, column, value):
+    """
+    Set one column of a placilo and return the updated row, or None
+
+    Raises NotUpdatable for columns outside UPDATABLE.
+    """
+    if column not in UPDATABLE:
+        raise NotUpdatable(column)
+    execute(cur, "posodobi_" + column, value, id)
+    return cur.fetchone()
+
+
+def delete_placilo(cur, id):
+    """
+    Delete a placilo and return its id, or None if it did not exist
+    """
+    execute(cur, "izbrisi_placilo", id)
+    row = cur.fetchone()
+    return None if row is None else row[0]
+
+
+def patch_placilo(cur, id, values, version=None):
+    """
+    Set several columns in one UPDATE and return the row and its version
+
+    With a `version`, the row is only updated if it is still at that
+    version. Returns None if no row was updated. Each combination of
+    columns is prepared as its own statement.
+    """
+    for column in values:
+        if column not in UPDATABLE:
+            raise NotUpdatable(column)
+    columns = [column for column in UPDATABLE if column in values]
+    params = [values[column] for column in columns] + [id]
+    name = "popravi_%d" % sum(1 << UPDATABLE.index(column) for column in columns)
+    statement = "UPDATE placila SET {} WHERE id = ${}".format(
+        ", ".join("{} = ${}".format(c, i) for i, c in enumerate(columns, 1)),
+        len(params),
+    )
+    if version is not None:
+        params.append(version)
+        name += "_v"
+        statement += " AND xmin = ${}::xid".format(len(params))
+    statement += " RETURNING {}, xmin::text".format(SELECT_COLUMNS)
+    cur.connection.execute_prepared(cur, name, statement, params)
+    row = cur.fetchone()
+    return None if row is None else (row[:-1], row[-1])
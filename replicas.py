@@ -0,0 +1,160 @@
+import itertools
+import threading
+import time
+
+from prometheus_client import Counter, Gauge
+
+REPLICA_LAG = Gauge(
+    "placila_replica_lag_seconds", "Replication lag of each read replica", ["replica"]
+)
+REPLICA_IN_USE = Gauge(
+    "placila_replica_in_use",
+    "Whether reads are routed to a replica, 0 while it is down or behind",
+    ["replica"],
+)
+DB_READS = Counter(
+    "placila_db_reads_total",
+    "Read requests by where they were routed",
+    ["target"],
+)
+
+# Lag in seconds; a replica that has replayed everything it received counts
+# as caught up, since on an idle primary the last replayed transaction can
+# be arbitrarily old. That only holds while its WAL receiver is streaming
+# and has heard from the primary within the last %s seconds; otherwise the
+# lag is NULL, i.e. unknown. Reading status and last_msg_receipt_time needs
+# the pg_read_all_stats role.
+LAG_QUERY = """SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN r.status IS DISTINCT FROM 'streaming'
+        OR r.last_msg_receipt_time IS NULL
+        OR r.last_msg_receipt_time < now() - %s * interval '1 second' THEN NULL
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+FROM (SELECT 1) AS one LEFT JOIN pg_stat_wal_receiver AS r ON true"""
+
+
+def parse_replicas(value):
+    """
+    Parse DATABASE_REPLICAS, a list or comma separated string of host:port
+    """
+    if isinstance(value, str):
+        value = [v for v in value.split(",") if v.strip()]
+    replicas = []
+    for replica in value or []:
+        host, _, port = replica.strip().rpartition(":")
+        if not host:
+            host, port = port, None
+        replicas.append((host, port))
+    return replicas
+
+
+class ReplicaRouter(object):
+    """
+    Picks the pool a read runs on: a read replica that is caught up, or
+    the primary
+
+    A background thread measures each replica's lag every `interval`
+    seconds. Replicas more than `max_lag` seconds behind, unreachable, not
+    measured yet, or whose WAL receiver has not heard from the primary for
+    `receiver_timeout` seconds are skipped; reads fall back to the primary while no
+    replica is usable. Rows changed within the last max_lag + interval
+    seconds may still be old on a replica, see changed_recently.
+    """
+
+    def __init__(
+        self, primary, replicas, max_lag=5.0, interval=2.0, receiver_timeout=60.0
+    ):
+        self.primary = primary
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.interval = interval
+        self.receiver_timeout = receiver_timeout
+        self.lag = {}
+        self._usable = []
+        self._next = itertools.count()
+        self._changed = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not self.replicas:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="replica-monitor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(self.interval)
+
+    def close(self):
+        for pool in self.replicas.values():
+            pool.closeall()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.check()
+            self._stopped.wait(self.interval)
+
+    def measure(self, pool):
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(LAG_QUERY, (self.receiver_timeout,))
+                lag = cur.fetchone()[0]
+            conn.rollback()
+        return float("inf") if lag is None else float(lag)
+
+    def check(self):
+        usable = []
+        for name, pool in self.replicas.items():
+            try:
+                lag = self.measure(pool)
+            except Exception:
+                lag = None
+            self.lag[name] = lag
+            if lag is not None:
+                REPLICA_LAG.labels(name).set(lag)
+            in_use = lag is not None and lag <= self.max_lag
+            REPLICA_IN_USE.labels(name).set(1 if in_use else 0)
+            if in_use:
+                usable.append(pool)
+        self._usable = usable
+
+    def pool_for_read(self, pinned=False):
+        """
+        Return the pool for a read; `pinned` reads always go to the primary
+        """
+        usable = self._usable
+        if pinned:
+            DB_READS.labels("pinned").inc()
+            return self.primary
+        if not self.replicas:
+            DB_READS.labels("primary").inc()
+            return self.primary
+        if not usable:
+            DB_READS.labels("fallback").inc()
+            return self.primary
+        DB_READS.labels("replica").inc()
+        return usable[next(self._next) % len(usable)]
+
+    def mark_changed(self, key):
+        if not self.replicas:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._changed[key] = now
+            if len(self._changed) > 10000:
+                horizon = now - self.max_lag - self.interval
+                self._changed = {k: t for k, t in self._changed.items() if t > horizon}
+
+    def changed_recently(self, key):
+        changed = self._changed.get(key)
+        return (
+            changed is not None
+            and time.monotonic() - changed < self.max_lag + self.interval
+        )
@@ -0,0 +1,66 @@
+import unittest
+
+from replicas import ReplicaRouter, parse_replicas
+
+
+class TestReplicaRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = ReplicaRouter("primary", {"replika:5433": "replika"}, max_lag=5)
+
+    def test_parse_replicas(self):
+        self.assertEqual(
+            parse_replicas("replika1:5433, replika2"),
+            [("replika1", "5433"), ("replika2", None)],
+        )
+        self.assertEqual(parse_replicas(""), [])
+
+    def test_reads_use_primary_until_replica_is_measured(self):
+        self.assertEqual(self.router.pool_for_read(), "primary")
+
+    def test_reads_avoid_lagging_replica(self):
+        self.router.measure = lambda pool: 1.0
+        self.router.check()
+        self.assertEqual(self.router.pool_for_read(), "replika")
+        self.assertEqual(self.router.pool_for_read(pinned=True), "primary")
+        self.router.measure = lambda pool: 10.0
+        self.router.check()
+        self.assertEqual(self.router.pool_for_read(), "primary")
+
+    def test_replica_without_wal_receiver_is_lagging(self):
+        class Cursor(object):
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                pass
+
+            def execute(self, query, params):
+                pass
+
+            def fetchone(self):
+                return (None,)
+
+        class Connection(Cursor):
+            def cursor(self):
+                return Cursor()
+
+            def rollback(self):
+                pass
+
+        class Pool(object):
+            def connection(self):
+                return Connection()
+
+        router = ReplicaRouter("primary", {"replika:5433": Pool()}, max_lag=5)
+        self.assertEqual(router.measure(Pool()), float("inf"))
+        router.check()
+        self.assertEqual(router.pool_for_read(), "primary")
+
+    def test_changed_recently(self):
+        self.router.mark_changed(1)
+        self.assertTrue(self.router.changed_recently(1))
+        self.assertFalse(self.router.changed_recently(2))
+
+
+if __name__ == "__main__":
+    unittest.main()
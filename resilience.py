@@ -0,0 +1,88 @@
+import threading
+import time
+
+from prometheus_client import Counter, Gauge
+
+CIRCUIT_STATE = Gauge(
+    "placila_circuit_state",
+    "Circuit breaker state (0 closed, 1 open, 2 half open)",
+    ["name"],
+)
+CIRCUIT_REJECTED = Counter(
+    "placila_circuit_rejected_total",
+    "Calls rejected because the circuit was open",
+    ["name"],
+)
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name):
+        super(CircuitOpen, self).__init__("Circuit {} is open".format(name))
+        self.name = name
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling a dependency after `failure_threshold` consecutive failures
+
+    Once open, calls are rejected for `reset_timeout` seconds, after which a
+    single trial call is let through. Its outcome closes or reopens the
+    circuit.
+    """
+
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._set_state(self.CLOSED)
+
+    def _set_state(self, state):
+        self.state = state
+        CIRCUIT_STATE.labels(self.name).set(state)
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at >= self.reset_timeout:
+                    self._set_state(self.HALF_OPEN)
+                    self._trial = False
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return
+        CIRCUIT_REJECTED.labels(self.name).inc()
+        raise CircuitOpen(self.name)
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial = False
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def call(self, fn, *args, **kwargs):
+        self.before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.failure()
+            raise
+        self.success()
+        return result
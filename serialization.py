@@ -0,0 +1,49 @@
+from decimal import Decimal
+from json.encoder import encode_basestring_ascii
+
+# Same keys, order and types as placiloApiModel in api.py
+PLACILO_JSON = (
+    '{"id": %s, "id_placnika": %s, "id_prejemnika": %s, '
+    '"znesek_eur": %s, "znesek_coin": %s, "status": %s}'
+)
+
+
+def _integer(value):
+    return "null" if value is None else "%d" % value
+
+
+def _string(value):
+    if value is None:
+        return "null"
+    if isinstance(value, Decimal):
+        # NUMERIC amounts are returned as plain decimal strings
+        return '"%s"' % format(value, "f")
+    return encode_basestring_ascii(str(value))
+
+
+def encode_placilo(row):
+    """
+    Encode a placila row, as returned by the cursor, as a JSON object
+
+    Builds the same JSON as marshalling the row with placiloApiModel,
+    without the intermediate dict and model object.
+    """
+    id, id_placnika, id_prejemnika, znesek_eur, znesek_coin, status = row
+    return PLACILO_JSON % (
+        _integer(id),
+        _integer(id_placnika),
+        _integer(id_prejemnika),
+        _string(znesek_eur),
+        _string(znesek_coin),
+        _string(status),
+    )
+
+
+def encode_placila(rows, naslednji=None):
+    """
+    Encode a page of placila rows like marshalling it with placilaApiModel
+    """
+    return '{"placila": [%s], "naslednji": %s}' % (
+        ", ".join(map(encode_placilo, rows)),
+        _integer(naslednji),
+    )
@@ -0,0 +1,36 @@
+import json
+import unittest
+from decimal import Decimal
+
+from flask_restx import marshal
+
+from api import PlaciloModel, placilaApiModel, placiloApiModel
+from serialization import encode_placila, encode_placilo
+
+
+class TestSerialization(unittest.TestCase):
+    rows = [
+        (1, 2, 3, Decimal("10.00"), Decimal("0.00000010"), "neplacano"),
+        (2, 2, 3, Decimal("5.5"), None, 'pla"cano č'),
+    ]
+
+    def marshalled(self, row):
+        return marshal(PlaciloModel.from_row(row), placiloApiModel)
+
+    def test_placilo_matches_marshal(self):
+        for row in self.rows:
+            self.assertEqual(json.loads(encode_placilo(row)), self.marshalled(row))
+
+    def test_page_matches_marshal(self):
+        expected = marshal(
+            {"placila": [self.marshalled(r) for r in self.rows], "naslednji": 2},
+            placilaApiModel,
+        )
+        self.assertEqual(json.loads(encode_placila(self.rows, 2)), expected)
+        self.assertEqual(
+            json.loads(encode_placila([])), {"placila": [], "naslednji": None}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
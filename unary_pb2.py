@@ -19,7 +19,7 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   syntax='proto3',
   serialized_options=None,
   create_key=_descriptor._internal_create_key,
-  serialized_pb=b'\n\x0bunary.proto\x12\x07Placila\"\x1a\n\x07Message\x12\x0f\n\x07message\x18\x01 \x01(\t\"4\n\x0fMessageResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x10\n\x08received\x18\x02 \x01(\x08\x32S\n\x0f\x63onvertToCrypto\x12@\n\x10\x63onvertToBitcoin\x12\x10.Placila.Message\x1a\x18.Placila.MessageResponse\"\x00\x62\x06proto3'
+  serialized_pb=b'\n\x0bunary.proto\x12\x07Placila\"\x1a\n\x07Message\x12\x0f\n\x07message\x18\x01 \x01(\t\"4\n\x0fMessageResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x10\n\x08received\x18\x02 \x01(\x08\" \n\x0c\x42\x61tchMessage\x12\x10\n\x08messages\x18\x01 \x03(\t\"C\n\x14\x42\x61tchMessageResponse\x12+\n\tresponses\x18\x01 \x03(\x0b\x32\x18.Placila.MessageResponse2\xf0\x01\n\x0f\x63onvertToCrypto\x12@\n\x10\x63onvertToBitcoin\x12\x10.Placila.Message\x1a\x18.Placila.MessageResponse\"\x00\x12O\n\x15\x63onvertToBitcoinBatch\x12\x15.Placila.BatchMessage\x1a\x1d.Placila.BatchMessageResponse\"\x00\x12J\n\x16\x63onvertToBitcoinStream\x12\x10.Placila.Message\x1a\x18.Placila.MessageResponse\"\x00(\x01\x30\x01\x62\x06proto3'
 )
 
 
@@ -95,8 +95,75 @@ _MESSAGERESPONSE = _descriptor.Descriptor(
   serialized_end=104,
 )
 
+
+_BATCHMESSAGE = _descriptor.Descriptor(
+  name='BatchMessage',
+  full_name='Placila.BatchMessage',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='messages', full_name='Placila.BatchMessage.messages', index=0,
+      number=1, type=9, cpp_type=9, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=106,
+  serialized_end=138,
+)
+
+
+_BATCHMESSAGERESPONSE = _descriptor.Descriptor(
+  name='BatchMessageResponse',
+  full_name='Placila.BatchMessageResponse',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='responses', full_name='Placila.BatchMessageResponse.responses', index=0,
+      number=1, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=140,
+  serialized_end=207,
+)
+
+_BATCHMESSAGERESPONSE.fields_by_name['responses'].message_type = _MESSAGERESPONSE
 DESCRIPTOR.message_types_by_name['Message'] = _MESSAGE
 DESCRIPTOR.message_types_by_name['MessageResponse'] = _MESSAGERESPONSE
+DESCRIPTOR.message_types_by_name['BatchMessage'] = _BATCHMESSAGE
+DESCRIPTOR.message_types_by_name['BatchMessageResponse'] = _BATCHMESSAGERESPONSE
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
 Message = _reflection.GeneratedProtocolMessageType('Message', (_message.Message,), {
@@ -113,6 +180,20 @@ MessageResponse = _reflection.GeneratedProtocolMessageType('MessageResponse', (_
   })
 _sym_db.RegisterMessage(MessageResponse)
 
+BatchMessage = _reflection.GeneratedProtocolMessageType('BatchMessage', (_message.Message,), {
+  'DESCRIPTOR' : _BATCHMESSAGE,
+  '__module__' : 'unary_pb2'
+  # @@protoc_insertion_point(class_scope:Placila.BatchMessage)
+  })
+_sym_db.RegisterMessage(BatchMessage)
+
+BatchMessageResponse = _reflection.GeneratedProtocolMessageType('BatchMessageResponse', (_message.Message,), {
+  'DESCRIPTOR' : _BATCHMESSAGERESPONSE,
+  '__module__' : 'unary_pb2'
+  # @@protoc_insertion_point(class_scope:Placila.BatchMessageResponse)
+  })
+_sym_db.RegisterMessage(BatchMessageResponse)
+
 
 
 _CONVERTTOCRYPTO = _descriptor.ServiceDescriptor(
@@ -122,8 +203,8 @@ _CONVERTTOCRYPTO = _descriptor.ServiceDescriptor(
   index=0,
   serialized_options=None,
   create_key=_descriptor._internal_create_key,
-  serialized_start=106,
-  serialized_end=189,
+  serialized_start=210,
+  serialized_end=450,
   methods=[
   _descriptor.MethodDescriptor(
     name='convertToBitcoin',
@@ -135,6 +216,26 @@ _CONVERTTOCRYPTO = _descriptor.ServiceDescriptor(
     serialized_options=None,
     create_key=_descriptor._internal_create_key,
   ),
+  _descriptor.MethodDescriptor(
+    name='convertToBitcoinBatch',
+    full_name='Placila.convertToCrypto.convertToBitcoinBatch',
+    index=1,
+    containing_service=None,
+    input_type=_BATCHMESSAGE,
+    output_type=_BATCHMESSAGERESPONSE,
+    serialized_options=None,
+    create_key=_descriptor._internal_create_key,
+  ),
+  _descriptor.MethodDescriptor(
+    name='convertToBitcoinStream',
+    full_name='Placila.convertToCrypto.convertToBitcoinStream',
+    index=2,
+    containing_service=None,
+    input_type=_MESSAGE,
+    output_type=_MESSAGERESPONSE,
+    serialized_options=None,
+    create_key=_descriptor._internal_create_key,
+  ),
 ])
 _sym_db.RegisterServiceDescriptor(_CONVERTTOCRYPTO)
 
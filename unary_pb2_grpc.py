@@ -19,6 +19,16 @@ class convertToCryptoStub(object):
                 request_serializer=unary__pb2.Message.SerializeToString,
                 response_deserializer=unary__pb2.MessageResponse.FromString,
                 )
+        self.convertToBitcoinBatch = channel.unary_unary(
+                '/Placila.convertToCrypto/convertToBitcoinBatch',
+                request_serializer=unary__pb2.BatchMessage.SerializeToString,
+                response_deserializer=unary__pb2.BatchMessageResponse.FromString,
+                )
+        self.convertToBitcoinStream = channel.stream_stream(
+                '/Placila.convertToCrypto/convertToBitcoinStream',
+                request_serializer=unary__pb2.Message.SerializeToString,
+                response_deserializer=unary__pb2.MessageResponse.FromString,
+                )
 
 
 class convertToCryptoServicer(object):
@@ -30,6 +40,20 @@ class convertToCryptoServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def convertToBitcoinBatch(self, request, context):
+        """Converts every amount in one call, responses are in request order
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def convertToBitcoinStream(self, request_iterator, context):
+        """Answers every streamed amount with one response, in order
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_convertToCryptoServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -38,6 +62,16 @@ def add_convertToCryptoServicer_to_server(servicer, server):
                     request_deserializer=unary__pb2.Message.FromString,
                     response_serializer=unary__pb2.MessageResponse.SerializeToString,
             ),
+            'convertToBitcoinBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.convertToBitcoinBatch,
+                    request_deserializer=unary__pb2.BatchMessage.FromString,
+                    response_serializer=unary__pb2.BatchMessageResponse.SerializeToString,
+            ),
+            'convertToBitcoinStream': grpc.stream_stream_rpc_method_handler(
+                    servicer.convertToBitcoinStream,
+                    request_deserializer=unary__pb2.Message.FromString,
+                    response_serializer=unary__pb2.MessageResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'Placila.convertToCrypto', rpc_method_handlers)
@@ -64,3 +98,37 @@ class convertToCrypto(object):
             unary__pb2.MessageResponse.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def convertToBitcoinBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Placila.convertToCrypto/convertToBitcoinBatch',
+            unary__pb2.BatchMessage.SerializeToString,
+            unary__pb2.BatchMessageResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def convertToBitcoinStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(request_iterator, target, '/Placila.convertToCrypto/convertToBitcoinStream',
+            unary__pb2.Message.SerializeToString,
+            unary__pb2.MessageResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)